@@ -1,12 +1,24 @@
-from dash import Dash, html, dcc
+from dash import Dash, html, dcc, ClientsideFunction, Patch, ctx, no_update
 import plotly.graph_objs as go
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-from flask import Flask, jsonify, request
+from dash.dependencies import Input, Output, State
+from flask import Flask, Response, g, jsonify, request
+import atexit
+from datetime import datetime
+import json
 import os
-import requests
+import time
 from dash_iconify import DashIconify  
 
+from batch_codec import BatchFormatError, decode_batch, decode_scores
+from instrumentation import Stats
+from metrics_log import MetricsLog, MetricsLogError
+from metrics_store import DEFAULT_STREAM, FLEET_ID, StreamRegistry
+from shared_state import SharedStreamRegistry
+from sketch import ScoreStats, merged_scores
+from timeseries import MetricsHistory, lttb
+from training_runs import TrainingRuns, to_rows
+
 # ----------------------------
 # Flask server for endpoints
 # ----------------------------
@@ -25,6 +37,126 @@ metrics_data = {
     "threshold": 1
 }
 
+# Retention: HISTORY_CAPACITY samples per metric (16 bytes each), optionally
+# also capped to the last HISTORY_MAX_AGE_S seconds.
+HISTORY_CAPACITY = int(os.environ.get("HISTORY_CAPACITY", 65536))
+HISTORY_MAX_AGE_S = os.environ.get("HISTORY_MAX_AGE_S")
+
+# Raw per-frame scores posted to /metrics/scores feed a t-digest and a fixed
+# histogram per stream; the threshold tracks SCORE_PERCENTILE of the scores.
+SCORE_CONFIG = {
+    "percentile": float(os.environ.get("SCORE_PERCENTILE", 99.0)),
+    "lo": float(os.environ.get("SCORE_MIN", 0.0)),
+    "hi": float(os.environ.get("SCORE_MAX", 1.0)),
+    "bins": int(os.environ.get("SCORE_BINS", 50)),
+}
+
+# Metrics are namespaced by stream_id (one per line/camera). Each stream has
+# its own store, history and score stats; FLEET_ID ("*") selects the
+# fleet-wide rollup.
+#
+# With METRICS_SHM_PATH set (e.g. /dev/shm/met-metrics) the latest values and
+# fleet rollup live in a shared mmap block instead, so the app can run under
+# several gunicorn workers. Use a threaded (or gevent) worker class, since
+# push mode below keeps long-lived connections open:
+#   gunicorn -w 4 -k gthread --threads 32 app:server
+# Only the latest values are shared. History, score sketches and training
+# runs stay per worker, so /metrics/history, /runs and the FPS / anomaly %
+# panels, score histogram and training curves show whichever worker served
+# the request. Those panels are therefore redrawn whole on every refresh in
+# this mode: dashboard-state cursors from one worker mean nothing to another.
+METRICS_SHM_PATH = os.environ.get("METRICS_SHM_PATH")
+METRICS_SHM_SLOTS = int(os.environ.get("METRICS_SHM_SLOTS", 256))
+
+def history_factory():
+    return MetricsHistory(
+        capacity=HISTORY_CAPACITY,
+        max_age=float(HISTORY_MAX_AGE_S) if HISTORY_MAX_AGE_S else None,
+    )
+
+def scores_factory():
+    return ScoreStats(**SCORE_CONFIG)
+
+if METRICS_SHM_PATH:
+    streams = SharedStreamRegistry(metrics_data, history_factory, scores_factory,
+                                   METRICS_SHM_PATH, METRICS_SHM_SLOTS)
+else:
+    streams = StreamRegistry(metrics_data, history_factory, scores_factory)
+streams.get(DEFAULT_STREAM)
+
+# The fleet has no per-stream history, so its rollup is sampled here after
+# every ingest request.
+fleet_history = history_factory()
+
+def record_fleet():
+    fleet_history.record(streams.fleet.snapshot()[0])
+
+# Model-evaluation curves (epoch/precision/recall/f1), keyed by run id.
+training_runs = TrainingRuns()
+
+# Per-route / per-callback latency and payload histograms, served as
+# Prometheus text on /internal/stats.
+stats = Stats()
+
+# Optional durability: with METRICS_LOG_DIR set, every accepted update is
+# journalled (group-committed) and replayed on startup, so restarts keep the
+# counters. METRICS_LOG_SYNC=0 acknowledges POSTs before the fsync.
+METRICS_LOG_DIR = os.environ.get("METRICS_LOG_DIR")
+METRICS_LOG_SYNC = os.environ.get("METRICS_LOG_SYNC", "1") != "0"
+METRICS_LOG_SNAPSHOT_EVERY = int(os.environ.get("METRICS_LOG_SNAPSHOT_EVERY", 100000))
+
+def current_state():
+    return {sid: streams.view(sid).snapshot()[0] for sid in streams.stream_ids()}
+
+def log_update(stream_id, old, new):
+    metrics_log.append(stream_id, {k: v for k, v in new.items() if old.get(k) != v})
+
+def commit_log():
+    # None once the update is journalled (or there is no journal), else a 503
+    # for the handler to return.
+    if metrics_log is None:
+        return None
+    try:
+        if METRICS_LOG_SYNC:
+            metrics_log.wait_committed()
+        else:
+            metrics_log.check()
+    except MetricsLogError as e:
+        return jsonify({"status": "error", "error": str(e)}), 503
+    return None
+
+metrics_log = None
+if METRICS_LOG_DIR:
+    if METRICS_SHM_PATH:
+        # One journal per deployment needs a single writer; a disk-backed
+        # METRICS_SHM_PATH already survives restarts in multi-worker mode.
+        raise RuntimeError("METRICS_LOG_DIR cannot be combined with METRICS_SHM_PATH")
+    metrics_log = MetricsLog(METRICS_LOG_DIR, current_state,
+                             snapshot_every=METRICS_LOG_SNAPSHOT_EVERY)
+    for stream_id, values in metrics_log.replay().items():
+        stream, _, _ = streams.update(stream_id, values)
+        # Score batches add to replayed counters (add_score_counts), even
+        # where the replayed values happen to match the placeholders.
+        stream.store.fresh = False
+    streams.on_update = log_update
+    atexit.register(metrics_log.close)
+
+# "push": browsers subscribe to /metrics/stream and refresh only on change.
+# "poll": the dcc.Interval drives every refresh (also the fallback when the
+# event stream drops).
+# Each tab in push mode holds two open requests (/metrics/stream and
+# /runs/stream), so the server needs a thread or greenlet per connection:
+# app.run(threaded=True), gunicorn -k gthread --threads N, or -k gevent.
+# Under gunicorn's default sync workers set DASHBOARD_MODE=poll.
+DASHBOARD_MODE = os.environ.get("DASHBOARD_MODE", "push")
+POLL_INTERVAL_MS = 1000
+STREAM_HEARTBEAT_S = 15
+# Min seconds between push events per connection; changes in between are
+# folded into the next event.
+STREAM_MIN_INTERVAL_S = float(os.environ.get("STREAM_MIN_INTERVAL_S", 0.25))
+# Max points per time-series panel, whatever the zoom level.
+SERIES_POINT_BUDGET = int(os.environ.get("SERIES_POINT_BUDGET", 500))
+
 # =======================
 # Styles
 # =======================
@@ -40,7 +172,12 @@ ICON_STYLE = {"fontSize": "28px", "marginRight": "8px"}
 # Layout
 # =======================
 app.layout = dbc.Container([
-    dcc.Interval(id="update-interval", interval=1000),
+    dcc.Interval(id="update-interval", interval=POLL_INTERVAL_MS,
+                 disabled=DASHBOARD_MODE == "push"),
+    dcc.Store(id="metrics-push", data={"mode": DASHBOARD_MODE, "version": None}),
+    dcc.Store(id="dashboard-state"),
+    dcc.Store(id="runs-push", data={"version": None}),
+    dcc.Store(id="curves-state"),
 
     # Logo + Title
     html.Div([
@@ -52,6 +189,14 @@ app.layout = dbc.Container([
                                                   "marginBottom": "25px"})
     ], style={"textAlign": "center"}),
 
+    # Stream selector
+    dbc.Row([
+        dbc.Col(dcc.Dropdown(id="stream-select",
+                             options=[{"label": "All streams", "value": FLEET_ID}],
+                             value=DEFAULT_STREAM,
+                             clearable=False), md=4, xs=12, className="mb-3"),
+    ], justify="center", className="my-2"),
+
     # Metric Tiles - Row 1
     dbc.Row([
         dbc.Col(dbc.Card(dbc.CardBody([
@@ -106,38 +251,112 @@ app.layout = dbc.Container([
         ]), style=CARD_STYLE), md=4, xs=12, className="mb-3"),
     ], className="my-2"),
 
-    # Pie Chart
+    # Pie Chart + Score Distribution
     dbc.Row([
         dbc.Col(dbc.Card(dbc.CardBody([
             html.H4("Normal vs Anomalous", style=TITLE_STYLE),
             dcc.Graph(id="pie-chart", style={"width": "100%", "height": "100%"})
+        ])), md=6, xs=12, style=CARD_STYLE, className="mb-3"),
+
+        dbc.Col(dbc.Card(dbc.CardBody([
+            html.H4("Score Distribution", style=TITLE_STYLE),
+            dcc.Graph(id="score-chart", style={"width": "100%", "height": "100%"})
+        ])), md=6, xs=12, style=CARD_STYLE, className="mb-3"),
+    ], className="my-2"),
+
+    # FPS + Anomaly % over time
+    dbc.Row([
+        dbc.Col(dbc.Card(dbc.CardBody([
+            html.H4("FPS", style=TITLE_STYLE),
+            dcc.Graph(id="fps-chart", style={"width": "100%", "height": "100%"})
+        ])), md=6, xs=12, style=CARD_STYLE, className="mb-3"),
+
+        dbc.Col(dbc.Card(dbc.CardBody([
+            html.H4("Anomaly %", style=TITLE_STYLE),
+            dcc.Graph(id="percent-chart", style={"width": "100%", "height": "100%"})
+        ])), md=6, xs=12, style=CARD_STYLE, className="mb-3"),
+    ], className="my-2"),
+
+    # Training curves
+    dbc.Row([
+        dbc.Col(dbc.Card(dbc.CardBody([
+            html.H4("Training Curves", style=TITLE_STYLE),
+            dcc.Dropdown(id="run-select", options=[], placeholder="Latest run",
+                         style={"maxWidth": "320px", "margin": "0 auto"}),
+            dcc.Graph(id="curves-chart", style={"width": "100%", "height": "100%"})
         ])), md=12, xs=12, style=CARD_STYLE, className="mb-3")
     ], className="my-2"),
 
 ], fluid=True, style=BACKGROUND_STYLE)
 
 # =======================
-# Dash callback
+# Dash callbacks
 # =======================
+app.clientside_callback(
+    ClientsideFunction(namespace="metrics", function_name="subscribe"),
+    Output("update-interval", "disabled"),
+    [Input("stream-select", "value")],
+    [State("metrics-push", "data")]
+)
+
+def stream_options(ids):
+    return ([{"label": "All streams", "value": FLEET_ID}]
+            + [{"label": sid, "value": sid} for sid in ids])
+
+TILE_OUTPUTS = ["scanned-tile", "anomalies-tile", "normal-tile",
+                "fps-tile", "percent-anomalous-tile", "threshold-tile"]
+# (graph id, history key) for the time-series panels
+SERIES_PANELS = [("fps-chart", "fps"), ("percent-chart", "percent_anomalous")]
+
 @app.callback(
-    [
-        Output("scanned-tile", "children"),
-        Output("anomalies-tile", "children"),
-        Output("normal-tile", "children"),
-        Output("fps-tile", "children"),
-        Output("percent-anomalous-tile", "children"),
-        Output("threshold-tile", "children"),
+    [Output(tile, "children") for tile in TILE_OUTPUTS]
+    + [
         Output("pie-chart", "figure"),
-    ],
-    [Input("update-interval", "n_intervals")]
+        Output("score-chart", "figure"),
+        Output("stream-select", "options"),
+    ]
+    + [Output(graph, "figure") for graph, _ in SERIES_PANELS]
+    + [Output(graph, "extendData") for graph, _ in SERIES_PANELS]
+    + [Output("dashboard-state", "data")],
+    [Input("update-interval", "n_intervals"),
+     Input("metrics-push", "data"),
+     Input("stream-select", "value")]
+    + [Input(graph, "relayoutData") for graph, _ in SERIES_PANELS],
+    [State("dashboard-state", "data")]
 )
-def update_dashboard(n):
-    try:
-        resp = requests.get("https://met-rbic.onrender.com/metrics", timeout=2)
-        data = resp.json()
-    except Exception as e:
-        print("Error fetching metrics:", e)
-        data = metrics_data
+def update_dashboard(n, pushed, stream_id, *args):
+    # dashboard-state remembers what this tab last rendered (stream, store
+    # version, tile values, series cursors), so unchanged outputs come back
+    # as no_update and figures change via Patch/extendData, not whole.
+    relayouts, state = args[:-1], args[-1] or {}
+    n_outputs = len(TILE_OUTPUTS) + 3 + 2 * len(SERIES_PANELS) + 1
+    stream_id = stream_id if streams.view(stream_id) is not None else DEFAULT_STREAM
+    data, version = streams.view(stream_id).snapshot()
+    trigger = ctx.triggered_id
+    relayout = trigger in [graph for graph, _ in SERIES_PANELS]
+
+    # New streams change the dropdown even while the selected one is idle.
+    ids = streams.stream_ids()
+    options = stream_options(ids) if ids != state.get("streams") else no_update
+
+    fresh = state.get("stream") != stream_id
+    if not fresh and not relayout and state.get("version") == version:
+        if options is no_update:
+            return [no_update] * n_outputs
+        out = [no_update] * n_outputs
+        out[len(TILE_OUTPUTS) + 2] = options
+        out[-1] = dict(state, streams=ids)
+        return out
+
+    if stream_id == FLEET_ID:
+        scores = merged_scores([s.scores for s in streams.all()], **SCORE_CONFIG)
+        if scores.scanned and data.get("threshold") is None:
+            data["threshold"] = round(scores.threshold(), 4)
+        history = fleet_history
+    else:
+        stream = streams.get(stream_id)
+        scores = stream.scores
+        history = stream.history
 
     scanned = data.get("scanned", 1)
     anomalies = data.get("anomalies", 0)
@@ -145,7 +364,45 @@ def update_dashboard(n):
     fps = data.get("fps", 0)
     percent_anomalous = data.get("percent_anomalous", round(anomalies / scanned * 100, 2))
     threshold = data.get("threshold", 0.5)
+    if threshold is None:
+        threshold = "–"
+
+    tiles = [scanned, anomalies, normal, fps, percent_anomalous, threshold]
+    last_tiles = state.get("tiles") or [None] * len(tiles)
+    tile_out = [v if fresh or v != last else no_update for v, last in zip(tiles, last_tiles)]
+
+    if fresh:
+        pie = pie_figure(normal, anomalies)
+    elif [normal, anomalies] != state.get("pie"):
+        pie = Patch()
+        pie["data"][0]["values"] = [normal, anomalies]
+    else:
+        pie = no_update
 
+    # Per-worker panels: no Patch/extendData against another worker's state.
+    local = not fresh and not METRICS_SHM_PATH
+    score, score_state = score_update(scores, state.get("score") if local else None)
+
+    figures, extends, series_state = [], [], {}
+    for (graph, key), relayout in zip(SERIES_PANELS, relayouts):
+        cursor = None if fresh else (state.get("series") or {}).get(key)
+        if cursor and METRICS_SHM_PATH:
+            cursor = {"range": cursor.get("range")}
+        if trigger == graph:
+            current = (cursor or {}).get("range")
+            visible = relayout_range(relayout, current)
+            if visible != current:
+                cursor = dict(cursor or {}, range=visible, stale=True)
+        figure, extend, series_state[key] = series_update(history, key, cursor)
+        figures.append(figure)
+        extends.append(extend)
+
+    new_state = {"stream": stream_id, "version": version, "tiles": tiles,
+                 "pie": [normal, anomalies], "score": score_state,
+                 "streams": ids, "series": series_state}
+    return tile_out + [pie, score, options] + figures + extends + [new_state]
+
+def pie_figure(normal, anomalies):
     fig = go.Figure(go.Pie(labels=["Normal", "Anomalous"],
                            values=[normal, anomalies],
                            marker=dict(colors=["green", "red"]),
@@ -153,27 +410,436 @@ def update_dashboard(n):
     fig.update_layout(margin=dict(l=20, r=20, t=20, b=20),
                       height=400,
                       paper_bgcolor="rgba(0,0,0,0)")
+    return fig
 
-    return scanned, anomalies, normal, fps, percent_anomalous, threshold, fig
+def score_update(scores, last):
+    # Full figure the first time or when the threshold marker appears;
+    # otherwise patch only the bar heights/colours and the marker position.
+    with scores.lock:
+        edges = scores.histogram.edges()
+        counts = scores.histogram.counts.tolist()
+        threshold = scores.threshold() if scores.scanned else None
+    centers = [(a + b) / 2 for a, b in zip(edges, edges[1:])]
+    colors = ["red" if threshold is not None and c > threshold else "green" for c in centers]
+    state = {"counts": counts, "threshold": threshold}
+
+    if last is None or (last.get("threshold") is None) != (threshold is None):
+        return score_figure(centers, counts, colors, edges[1] - edges[0], threshold), state
+    if last.get("counts") == counts and last.get("threshold") == threshold:
+        return no_update, state
+
+    patch = Patch()
+    patch["data"][0]["y"] = counts
+    patch["data"][0]["marker"]["color"] = colors
+    if threshold is not None:
+        patch["layout"]["shapes"][0]["x0"] = threshold
+        patch["layout"]["shapes"][0]["x1"] = threshold
+        patch["layout"]["annotations"][0]["x"] = threshold
+        patch["layout"]["annotations"][0]["text"] = "threshold %.3f" % threshold
+    return patch, state
+
+def score_figure(centers, counts, colors, width, threshold):
+    fig = go.Figure(go.Bar(x=centers, y=counts, marker=dict(color=colors), width=width))
+    if threshold is not None:
+        fig.add_vline(x=threshold, line_dash="dash", line_color="#333",
+                      annotation_text="threshold %.3f" % threshold)
+    fig.update_layout(margin=dict(l=20, r=20, t=20, b=20),
+                      height=400,
+                      bargap=0,
+                      xaxis_title="anomaly score",
+                      yaxis_title="frames",
+                      paper_bgcolor="rgba(0,0,0,0)",
+                      plot_bgcolor="rgba(0,0,0,0)")
+    return fig
+
+def relayout_range(relayout, current):
+    # Zoom/pan gives xaxis.range[0]/[1]; double-click reset gives autorange.
+    if not relayout:
+        return current
+    if relayout.get("xaxis.autorange"):
+        return None
+    lo = relayout.get("xaxis.range[0]")
+    hi = relayout.get("xaxis.range[1]")
+    if lo is None and "xaxis.range" in relayout:
+        lo, hi = relayout["xaxis.range"]
+    if lo is None or hi is None:
+        return current
+    try:
+        return [datetime.fromisoformat(str(lo)).timestamp(),
+                datetime.fromisoformat(str(hi)).timestamp()]
+    except ValueError:
+        return current
+
+def series_update(history, key, cursor):
+    # Returns (figure, extendData, cursor). The visible range is redrawn at
+    # most SERIES_POINT_BUDGET points (LTTB); while following live data new
+    # points are appended with extendData until another budget/2 have
+    # arrived, then the whole range is re-downsampled. The cursor follows the
+    # series by sample count ("seq"), not timestamp: out-of-order samples are
+    # stored with the previous timestamp and would be skipped by t > last_t.
+    cursor = dict(cursor or {})
+    visible = cursor.get("range")
+    redraw = (cursor.get("seq") is None or cursor.get("stale")
+              or cursor.get("appended", 0) > SERIES_POINT_BUDGET // 2)
+    if not redraw and visible is not None:
+        return no_update, no_update, cursor
+
+    if not redraw:
+        result = history.tail(key, cursor["seq"])
+        # Fewer samples than the cursor has seen: not the history it was
+        # built on (e.g. after a restart), so start over.
+        redraw = result is None or result["seq"] < cursor["seq"]
+
+    if redraw:
+        result = history.query(key, *(visible or (None, None))) or {"t": [], "v": [], "seq": 0}
+        t, v = lttb(result["t"], result["v"], SERIES_POINT_BUDGET)
+        cursor = {"range": visible, "appended": 0, "seq": result["seq"]}
+        return series_figure(key, t, v, visible), no_update, cursor
+
+    cursor["seq"] = result["seq"]
+    if not result["t"]:
+        return no_update, no_update, cursor
+    t, v = lttb(result["t"], result["v"], SERIES_POINT_BUDGET)
+    cursor["appended"] = cursor.get("appended", 0) + len(t)
+    extend = ({"x": [[datetime.fromtimestamp(x) for x in t]], "y": [v]}, [0],
+              SERIES_POINT_BUDGET + SERIES_POINT_BUDGET // 2)
+    return no_update, extend, cursor
+
+def series_figure(key, t, v, visible):
+    fig = go.Figure(go.Scattergl(x=[datetime.fromtimestamp(x) for x in t], y=v,
+                                 mode="lines", line=dict(color="#2a2a2a")))
+    fig.update_layout(margin=dict(l=20, r=20, t=20, b=20),
+                      height=300,
+                      uirevision=key,
+                      paper_bgcolor="rgba(0,0,0,0)",
+                      plot_bgcolor="rgba(0,0,0,0)")
+    if visible is not None:
+        fig.update_xaxes(range=[datetime.fromtimestamp(x) for x in visible])
+    return fig
+
+@app.callback(
+    [
+        Output("run-select", "options"),
+        Output("curves-chart", "figure"),
+        Output("curves-chart", "extendData"),
+        Output("curves-state", "data"),
+    ],
+    [Input("update-interval", "n_intervals"),
+     Input("runs-push", "data"),
+     Input("run-select", "value")],
+    [State("curves-state", "data")]
+)
+def update_curves(n, pushed, run_id, state):
+    # Same idea as update_dashboard: redraw on run switch or new metric
+    # column, otherwise extendData with only the epochs this tab hasn't got.
+    state = state or {}
+    ids = training_runs.run_ids()
+    options = [{"label": rid, "value": rid} for rid in ids] if ids != state.get("runs") else no_update
+    run_id = run_id if run_id in ids else training_runs.latest()
+    version = training_runs.run_version(run_id) if run_id is not None else None
+    new_state = {"runs": ids, "run": run_id, "version": version,
+                 "columns": state.get("columns"), "last_epoch": state.get("last_epoch")}
+
+    if run_id is None:
+        figure = curves_figure({}) if not state or state.get("run") is not None else no_update
+        return options, figure, no_update, new_state
+    # Runs are per worker under METRICS_SHM_PATH, and so are their versions:
+    # always redraw there.
+    local = run_id == state.get("run") and not METRICS_SHM_PATH
+    if local and version == state.get("version"):
+        return options, no_update, no_update, new_state
+
+    if local and state.get("last_epoch") is not None:
+        _, columns = training_runs.get(run_id, since_epoch=state["last_epoch"])
+        names = [k for k in columns if k != "epoch"]
+        if names == state.get("columns"):
+            if not columns["epoch"]:
+                return options, no_update, no_update, new_state
+            new_state["last_epoch"] = columns["epoch"][-1]
+            extend = ({"x": [columns["epoch"]] * len(names), "y": [columns[k] for k in names]},
+                      list(range(len(names))))
+            return options, no_update, extend, new_state
+
+    _, columns = training_runs.get(run_id)
+    new_state["columns"] = [k for k in columns if k != "epoch"]
+    new_state["last_epoch"] = columns["epoch"][-1] if columns["epoch"] else None
+    return options, curves_figure(columns), no_update, new_state
+
+def curves_figure(columns):
+    fig = go.Figure([go.Scatter(x=columns["epoch"], y=values, mode="lines+markers", name=name)
+                     for name, values in columns.items() if name != "epoch"])
+    fig.update_layout(margin=dict(l=20, r=20, t=20, b=20),
+                      height=350,
+                      xaxis_title="epoch",
+                      yaxis=dict(range=[0, 1]),
+                      paper_bgcolor="rgba(0,0,0,0)",
+                      plot_bgcolor="rgba(0,0,0,0)")
+    return fig
+
+# =======================
+# Instrumentation
+# =======================
+_callback_names = {}
+
+def callback_name(output):
+    # Dash posts every server callback to one route; its "output" string
+    # identifies which callback ran.
+    name = _callback_names.get(output)
+    if name is None:
+        func = app.callback_map.get(output, {}).get("callback")
+        name = _callback_names[output] = getattr(func, "__name__", output)
+    return name
+
+@server.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@server.after_request
+def record_request_stats(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    size = response.content_length or 0
+    stats.observe_route(route, request.method, str(response.status_code), elapsed,
+                        request.content_length or 0, size)
+    if route.endswith("_dash-update-component"):
+        body = request.get_json(silent=True) or {}
+        stats.observe_callback(callback_name(body.get("output", "")), elapsed, size)
+    return response
+
+@server.route("/internal/stats", methods=["GET"])
+def internal_stats():
+    return Response(stats.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 # =======================
 # Backend endpoints
 # =======================
+def request_stream_id(body=None):
+    # stream_id may come in the JSON body or as ?stream_id=; legacy clients
+    # that send neither land on the default stream.
+    if body is not None and "stream_id" in body:
+        return str(body.pop("stream_id"))
+    return request.args.get("stream_id", DEFAULT_STREAM)
+
 @server.route("/metrics", methods=["GET"])
 def metrics_get():
-    return jsonify(metrics_data)
+    view = streams.view(request_stream_id())
+    if view is None:
+        return jsonify({"error": "unknown stream", "streams": streams.stream_ids()}), 404
+    data, _ = view.snapshot()
+    return jsonify(data)
+
+@server.route("/metrics/streams", methods=["GET"])
+def metrics_streams_get():
+    fleet, _ = streams.fleet.snapshot()
+    return jsonify({"streams": streams.stream_ids(), "fleet": fleet})
 
 @server.route("/metrics", methods=["POST"])
 def metrics_post():
-    global metrics_data
     incoming = request.get_json(force=True)
-    for key, value in incoming.items():
-        if key in metrics_data:
-            metrics_data[key] = value
-    return jsonify({"status": "updated", "metrics": metrics_data})
+    stream_id = request_stream_id(incoming)
+    try:
+        stream, data, _ = streams.update(stream_id, incoming)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    # epochs/precision/recall/f1 arrays go to the run's curves; only epochs
+    # newer than what is stored get appended. Only the columnar "epochs" form
+    # counts here, so a sample that happens to carry an "epoch" key doesn't
+    # turn scanned/fps into curve columns (/runs/<run_id>/epochs takes rows).
+    rows = to_rows(incoming) if isinstance(incoming.get("epochs"), list) else None
+    if rows:
+        training_runs.append(str(incoming.get("run_id", stream_id)), rows)
+    stream.history.record({k: v for k, v in incoming.items() if k in data})
+    record_fleet()
+    failed = commit_log()
+    if failed is not None:
+        return failed
+    stats.count_ingest("metrics", 1)
+    return jsonify({"status": "updated", "metrics": data})
+
+@server.route("/metrics/batch", methods=["POST"])
+def metrics_batch_post():
+    # Many timestamped samples per request (NDJSON or packed float64, see
+    # batch_codec). The store sees one merged update: last value per key wins.
+    try:
+        samples = decode_batch(request.get_data(cache=False), request.content_type)
+    except BatchFormatError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    default_id = request_stream_id()
+    by_stream = {}
+    for sample in samples:
+        by_stream.setdefault(str(sample.pop("stream_id", default_id)), []).append(sample)
+
+    if FLEET_ID in by_stream:
+        return jsonify({"status": "error", "error": "%r is reserved for the fleet view" % FLEET_ID}), 400
+
+    versions = {}
+    for stream_id, group in by_stream.items():
+        latest = {}
+        for sample in group:
+            latest.update(sample)
+        latest.pop("ts", None)
+        try:
+            stream, data, versions[stream_id] = streams.update(stream_id, latest)
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e), "versions": versions}), 400
+        stream.history.record_many(group, keys=data)
+    record_fleet()
+    failed = commit_log()
+    if failed is not None:
+        return failed
+    stats.count_ingest("batch", len(samples))
+    return jsonify({"status": "updated", "accepted": len(samples), "versions": versions})
+
+SCORE_KEYS = ("scanned", "anomalies", "total_normal", "percent_anomalous", "threshold")
+
+def _count(value):
+    return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+def add_score_counts(accepted, flagged, threshold):
+    # A score batch adds to the stream's stored counters instead of replacing
+    # them, so batches landing on other workers (METRICS_SHM_PATH) are kept.
+    # A stream still on its placeholder values starts from zero.
+    def apply(current, fresh):
+        scanned = accepted + (0 if fresh else _count(current.get("scanned")))
+        anomalies = flagged + (0 if fresh else _count(current.get("anomalies")))
+        return {
+            "scanned": scanned,
+            "anomalies": anomalies,
+            "total_normal": scanned - anomalies,
+            "percent_anomalous": round(anomalies / scanned * 100, 2) if scanned else 0,
+            "threshold": threshold,
+        }
+    return apply
+
+@server.route("/metrics/scores", methods=["POST"])
+def metrics_scores_post():
+    # Raw per-frame anomaly scores (JSON list or packed float64). The stream's
+    # scanned/anomalies/threshold are then derived here, not by the client.
+    try:
+        scores = decode_scores(request.get_data(cache=False), request.content_type)
+    except BatchFormatError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    stream_id = request_stream_id()
+    try:
+        stream = streams.get(stream_id)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    score_stats = stream.scores
+    with score_stats.lock:
+        accepted, flagged = score_stats.add_scores(scores)
+        threshold = round(score_stats.threshold(), 4)
+        _, data, _ = streams.apply(stream_id, add_score_counts(accepted, flagged, threshold))
+    stream.history.record({key: data[key] for key in SCORE_KEYS})
+    record_fleet()
+    failed = commit_log()
+    if failed is not None:
+        return failed
+    stats.count_ingest("scores", accepted)
+    return jsonify({"status": "updated", "accepted": accepted, "anomalies": flagged,
+                    "threshold": threshold})
+
+@server.route("/metrics/history", methods=["GET"])
+def metrics_history_get():
+    stream = streams.get(request_stream_id(), create=False)
+    if stream is None:
+        return jsonify({"error": "unknown stream", "streams": streams.stream_ids()}), 404
+    key = request.args.get("key")
+    if not key:
+        return jsonify({"error": "missing key", "keys": stream.history.keys()}), 400
+    since = request.args.get("since", type=float)
+    until = request.args.get("until", type=float)
+    result = stream.history.query(key, since, until)
+    if result is None:
+        return jsonify({"error": "unknown key", "keys": stream.history.keys()}), 404
+    result["stream_id"] = stream.stream_id
+    return jsonify(result)
+
+@server.route("/runs", methods=["GET"])
+def runs_get():
+    runs, _ = training_runs.snapshot()
+    return jsonify({"runs": runs})
+
+@server.route("/runs/<run_id>/epochs", methods=["POST"])
+def runs_epochs_post(run_id):
+    # One epoch ({"epoch": 7, "f1": ...}), a list of them, or parallel lists.
+    rows = to_rows(request.get_json(force=True))
+    if not rows:
+        return jsonify({"status": "error", "error": "no epochs in body"}), 400
+    added, version = training_runs.append(run_id, rows)
+    if not added:
+        return jsonify({"status": "error", "error": "no new epochs in body", "version": version}), 400
+    stats.count_ingest("epochs", added)
+    return jsonify({"status": "updated", "appended": added, "version": version})
+
+def run_etag(run_id, version):
+    # The instance id keeps a restarted process (or another worker, whose
+    # runs are its own) from matching an ETag for different contents.
+    return "%s-%s-%d" % (run_id, training_runs.instance, version)
+
+@server.route("/runs/<run_id>", methods=["GET"])
+def runs_curves_get(run_id):
+    # Columnar slice ?since_epoch=&limit=. The ETag carries the run version
+    # (run_etag), so an unchanged run answers If-None-Match with 304 before
+    # building JSON.
+    version = training_runs.run_version(run_id)
+    if version is None:
+        return jsonify({"error": "unknown run", "runs": training_runs.run_ids()}), 404
+    etag = run_etag(run_id, version)
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+    since_epoch = request.args.get("since_epoch", type=float)
+    limit = request.args.get("limit", type=int)
+    version, columns = training_runs.get(run_id, since_epoch, limit)
+    resp = jsonify({"run_id": run_id, "version": version, "columns": columns})
+    resp.set_etag(run_etag(run_id, version))
+    return resp
+
+def sse_response(view):
+    # Server-Sent Events: one event per version of `view`, at most one per
+    # STREAM_MIN_INTERVAL_S, heartbeat comments in between so proxies don't
+    # close an idle connection.
+    def events():
+        _, version = view.snapshot()
+        yield "retry: %d\ndata: %s\n\n" % (POLL_INTERVAL_MS, json.dumps({"version": version}))
+        sent_at = time.monotonic()
+        while True:
+            new_version = view.wait_for_change(version, timeout=STREAM_HEARTBEAT_S)
+            if new_version == version:
+                yield ": keep-alive\n\n"
+                continue
+            delay = sent_at + STREAM_MIN_INTERVAL_S - time.monotonic()
+            if delay > 0:
+                # Bumps landing while we wait go out as this one event.
+                time.sleep(delay)
+                new_version = view.version
+            version = new_version
+            yield "data: %s\n\n" % json.dumps({"version": version})
+            sent_at = time.monotonic()
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@server.route("/metrics/stream", methods=["GET"])
+def metrics_stream():
+    # Follows the selected stream, or the fleet rollup for stream_id=*.
+    view = streams.view(request_stream_id())
+    if view is None:
+        return jsonify({"error": "unknown stream", "streams": streams.stream_ids()}), 404
+    return sse_response(view)
+
+@server.route("/runs/stream", methods=["GET"])
+def runs_stream():
+    return sse_response(training_runs)
 
 # =======================
 # Run
 # =======================
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8050)), debug=False)
+    # threaded so each open /metrics/stream doesn't block the other routes
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8050)), debug=False, threaded=True)
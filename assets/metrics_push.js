@@ -0,0 +1,76 @@
+// Push channel for the dashboard: subscribe to /metrics/stream for the
+// selected stream (and to /runs/stream for training curves) and poke the
+// matching dcc.Store whenever the server reports a new version. The
+// dcc.Interval drives both the metrics panels and the curves, so it stays on
+// unless both sources are open. A source the server refused outright (e.g. a
+// 404 for a camera that has not posted since a restart) ends up CLOSED and
+// is re-opened after PUSH_RETRY_MS; EventSource retries the rest itself.
+var PUSH_RETRY_MS = 5000;
+
+function pushSources() {
+    window._pushSources = window._pushSources || {};
+    window._pushOpen = window._pushOpen || {};
+    return window._pushSources;
+}
+
+function pushConnected() {
+    return !!(window._pushOpen.metrics && window._pushOpen.runs);
+}
+
+function setPushOpen(name, open) {
+    window._pushOpen[name] = open;
+    dash_clientside.set_props("update-interval", {disabled: pushConnected()});
+}
+
+function openPushSource(name, url, storeId, extra) {
+    var source = new EventSource(url);
+    pushSources()[name] = source;
+    window._pushOpen[name] = false;
+    source.onopen = function () {
+        setPushOpen(name, true);
+    };
+    source.onmessage = function (event) {
+        var msg = JSON.parse(event.data);
+        dash_clientside.set_props(storeId, {
+            data: Object.assign({version: msg.version}, extra)
+        });
+    };
+    source.onerror = function () {
+        setPushOpen(name, false);
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(function () {
+                // Skip if the source was replaced meanwhile (stream switch).
+                if (pushSources()[name] === source) {
+                    openPushSource(name, url, storeId, extra);
+                }
+            }, PUSH_RETRY_MS);
+        }
+    };
+    return source;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    metrics: {
+        subscribe: function (streamId, pushed) {
+            if (!pushed || pushed.mode !== "push" || !window.EventSource) {
+                return false;
+            }
+            var sources = pushSources();
+            if (!sources.runs) {
+                openPushSource("runs", "/runs/stream", "runs-push", {});
+            }
+            if (sources.metrics) {
+                if (window._metricsStreamId === streamId) {
+                    return pushConnected();
+                }
+                sources.metrics.close();
+            }
+            openPushSource("metrics",
+                "/metrics/stream?stream_id=" + encodeURIComponent(streamId),
+                "metrics-push", {mode: "push", stream: streamId});
+            window._metricsStreamId = streamId;
+            // Keep polling until the new source opens.
+            return false;
+        }
+    }
+});
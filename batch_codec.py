@@ -0,0 +1,165 @@
+from array import array
+import json
+import math
+import struct
+import sys
+
+
+# =======================
+# Batch wire formats
+# =======================
+# A batch is a list of samples: dicts of metric -> number, plus an optional
+# "ts" (unix seconds). Two encodings are accepted by POST /metrics/batch:
+#
+#   application/x-ndjson          one JSON object per line
+#   application/x-metrics-packed  packed float64 columns, layout below
+#
+# Packed layout (little-endian):
+#   b"MTB1" | u16 n_fields | n_fields x (u8 len, utf-8 name) | u32 n_records
+#   | n_records x n_fields float64
+# Field 0 is always "ts". NaN marks a metric that is absent from a sample.
+#
+# Both decoders reject samples whose "ts" or metric values are not finite
+# numbers ("stream_id" excepted), so a bad body is a 400 before anything in
+# it is applied.
+NDJSON_TYPE = "application/x-ndjson"
+PACKED_TYPE = "application/x-metrics-packed"
+PACKED_MAGIC = b"MTB1"
+
+# Raw anomaly scores for POST /metrics/scores: either a JSON list (or
+# {"scores": [...]}) or a bare run of little-endian float64.
+SCORES_TYPE = "application/octet-stream"
+
+
+class BatchFormatError(ValueError):
+    pass
+
+
+def _is_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+
+def _check_sample(sample, where):
+    for key, value in sample.items():
+        if key != "stream_id" and not _is_number(value):
+            raise BatchFormatError("%s: %r must be a finite number, got %r" % (where, key, value))
+    return sample
+
+
+def encode_ndjson(samples):
+    return "".join(json.dumps(s, separators=(",", ":")) + "\n" for s in samples).encode()
+
+
+def decode_ndjson(body):
+    samples = []
+    for lineno, line in enumerate(body.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            sample = json.loads(line)
+        except ValueError as e:
+            raise BatchFormatError("line %d: %s" % (lineno, e))
+        if not isinstance(sample, dict):
+            raise BatchFormatError("line %d: expected a JSON object" % lineno)
+        samples.append(_check_sample(sample, "line %d" % lineno))
+    return samples
+
+
+def encode_packed(samples, fields=None):
+    if fields is None:
+        fields = sorted({k for s in samples for k, v in s.items()
+                         if k != "ts" and isinstance(v, (int, float))})
+    fields = ["ts"] + [f for f in fields if f != "ts"]
+    header = [PACKED_MAGIC, struct.pack("<H", len(fields))]
+    for name in fields:
+        raw = name.encode()
+        header.append(struct.pack("<B", len(raw)) + raw)
+    header.append(struct.pack("<I", len(samples)))
+    values = array("d", (float(s.get(f, math.nan)) for s in samples for f in fields))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return b"".join(header) + values.tobytes()
+
+
+def decode_packed(body):
+    view = memoryview(body)
+    if bytes(view[:4]) != PACKED_MAGIC:
+        raise BatchFormatError("bad magic")
+    try:
+        (n_fields,) = struct.unpack_from("<H", view, 4)
+        pos = 6
+        fields = []
+        for _ in range(n_fields):
+            (length,) = struct.unpack_from("<B", view, pos)
+            fields.append(bytes(view[pos + 1:pos + 1 + length]).decode())
+            pos += 1 + length
+        (n_records,) = struct.unpack_from("<I", view, pos)
+        pos += 4
+    except struct.error as e:
+        raise BatchFormatError("truncated header: %s" % e)
+    except UnicodeDecodeError as e:
+        raise BatchFormatError("field name is not UTF-8: %s" % e)
+    if not fields or fields[0] != "ts":
+        raise BatchFormatError("first field must be ts")
+    expected = n_records * n_fields * 8
+    if len(view) - pos != expected:
+        raise BatchFormatError("expected %d payload bytes, got %d" % (expected, len(view) - pos))
+
+    values = array("d")
+    values.frombytes(view[pos:])
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    samples = []
+    for r in range(n_records):
+        row = values[r * n_fields:(r + 1) * n_fields]
+        sample = {f: (int(v) if f != "ts" and v.is_integer() else v)
+                  for f, v in zip(fields, row) if not math.isnan(v)}
+        samples.append(_check_sample(sample, "record %d" % r))
+    return samples
+
+
+def decode_batch(body, content_type):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type == PACKED_TYPE:
+        return decode_packed(body)
+    if content_type in (NDJSON_TYPE, "application/jsonl", "application/json", "text/plain", ""):
+        return decode_ndjson(body)
+    raise BatchFormatError("unsupported content type %r" % content_type)
+
+
+def encode_scores(scores):
+    values = array("d", scores)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def decode_scores(body, content_type):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type == SCORES_TYPE:
+        if len(body) % 8:
+            raise BatchFormatError("score payload is not a whole number of float64")
+        values = array("d")
+        values.frombytes(body)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise BatchFormatError(str(e))
+    if isinstance(payload, dict):
+        payload = payload.get("scores")
+    if not isinstance(payload, list):
+        raise BatchFormatError("expected a list of scores")
+    try:
+        return array("d", payload)
+    except TypeError:
+        raise BatchFormatError("scores must be numbers")
@@ -0,0 +1,210 @@
+import argparse
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+from batch_codec import NDJSON_TYPE, encode_ndjson
+from testing_sim import make_frame_sample
+
+
+# =======================
+# Load-test harness
+# =======================
+# Starts app.py locally (unless --url is given), then drives it from a pool of
+# processes: producers POSTing samples to /metrics or /metrics/batch, and
+# dashboard clients replaying the update_dashboard callback the way a browser
+# tab does. Reports client-side throughput and p50/p99/p999 latency, then the
+# server's own numbers from /internal/stats.
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_server(port, env_overrides):
+    env = dict(os.environ, PORT=str(port), DASHBOARD_MODE="poll", **env_overrides)
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "app.py")], cwd=HERE, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = "http://127.0.0.1:%d" % port
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("app.py exited with code %d" % proc.returncode)
+        try:
+            if requests.get(base_url + "/metrics", timeout=1).ok:
+                return proc, base_url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("app.py did not come up on port %d" % port)
+
+
+def paced(rate, duration):
+    # Yields once per tick at `rate` per second (as fast as possible if 0)
+    # until `duration` seconds have passed.
+    deadline = time.monotonic() + duration
+    next_at = time.monotonic()
+    while time.monotonic() < deadline:
+        yield
+        if rate:
+            next_at += 1.0 / rate
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+
+# =======================
+# Clients
+# =======================
+def producer(base_url, stream_id, rate, batch_size, duration):
+    session = requests.Session()
+    state = {"scanned": 0, "anomalies": 0}
+    latencies, errors, samples = [], 0, 0
+    for _ in paced(rate, duration):
+        batch = [dict(make_frame_sample(state), stream_id=stream_id) for _ in range(batch_size)]
+        started = time.perf_counter()
+        try:
+            if batch_size == 1:
+                resp = session.post(base_url + "/metrics", json=batch[0], timeout=10)
+            else:
+                resp = session.post(base_url + "/metrics/batch", data=encode_ndjson(batch),
+                                    headers={"Content-Type": NDJSON_TYPE}, timeout=10)
+            ok = resp.ok
+        except requests.RequestException:
+            ok = False
+        latencies.append(time.perf_counter() - started)
+        if ok:
+            samples += len(batch)
+        else:
+            errors += 1
+    return "ingest", latencies, errors, samples
+
+
+def dashboard_spec(base_url):
+    for spec in requests.get(base_url + "/_dash-dependencies", timeout=5).json():
+        if "scanned-tile.children" in spec["output"]:
+            return spec
+    raise RuntimeError("update_dashboard callback not found")
+
+
+def _outputs(output):
+    outputs = []
+    for part in output.strip(".").split("..."):
+        component, _, prop = part.rpartition(".")
+        outputs.append({"id": component, "property": prop})
+    return outputs
+
+
+def dashboard_client(base_url, stream_id, rate, duration):
+    # Replays update_dashboard from an interval tick, carrying dashboard-state
+    # between calls like a real tab so no_update/Patch paths get exercised.
+    spec = dashboard_spec(base_url)
+    session = requests.Session()
+    values = {
+        "update-interval.n_intervals": 0,
+        "metrics-push.data": {"mode": "poll", "version": None},
+        "stream-select.value": stream_id,
+    }
+    state = None
+    latencies, errors, calls = [], 0, 0
+    for _ in paced(rate, duration):
+        values["update-interval.n_intervals"] += 1
+        body = {
+            "output": spec["output"],
+            "outputs": _outputs(spec["output"]),
+            "inputs": [dict(i, value=values.get("%s.%s" % (i["id"], i["property"])))
+                       for i in spec["inputs"]],
+            "state": [dict(s, value=state) for s in spec["state"]],
+            "changedPropIds": ["update-interval.n_intervals"],
+        }
+        started = time.perf_counter()
+        try:
+            resp = session.post(base_url + "/_dash-update-component", json=body, timeout=10)
+            ok = resp.status_code in (200, 204)
+            if resp.status_code == 200:
+                state = resp.json()["response"].get("dashboard-state", {}).get("data", state)
+        except (requests.RequestException, ValueError, KeyError):
+            ok = False
+        latencies.append(time.perf_counter() - started)
+        calls += 1
+        if not ok:
+            errors += 1
+    return "dashboard", latencies, errors, calls
+
+
+def run_client(kind, *args):
+    return (producer if kind == "ingest" else dashboard_client)(*args)
+
+
+# =======================
+# Reporting
+# =======================
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def report(name, results, duration):
+    latencies = sorted(l for r in results for l in r[1])
+    errors = sum(r[2] for r in results)
+    units = sum(r[3] for r in results)
+    unit = "samples" if name == "ingest" else "calls"
+    print("%-10s requests=%-7d %s/s=%-9.1f p50=%7.2fms p99=%7.2fms p999=%7.2fms errors=%d" % (
+        name, len(latencies), unit, units / duration,
+        percentile(latencies, 0.50) * 1000, percentile(latencies, 0.99) * 1000,
+        percentile(latencies, 0.999) * 1000, errors))
+
+
+def server_summary(base_url):
+    # Mean server-side latency per route/callback from the histogram sums.
+    text = requests.get(base_url + "/internal/stats", timeout=5).text
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        for kind in ("http_request_duration_seconds", "dash_callback_duration_seconds"):
+            for suffix, target in (("_sum{", sums), ("_count{", counts)):
+                prefix = "met_" + kind + suffix
+                if line.startswith(prefix):
+                    labels, value = line[len(prefix):].rsplit("} ", 1)
+                    target[(kind, labels)] = float(value)
+    print("server-side means (from /internal/stats):")
+    for key in sorted(counts):
+        if counts[key]:
+            print("  %-32s %-60s n=%-7d mean=%.2fms" % (
+                key[0], key[1], counts[key], sums.get(key, 0) / counts[key] * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the ingest and dashboard paths.")
+    parser.add_argument("--url", default=None, help="existing server; default starts app.py locally")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--producers", type=int, default=8)
+    parser.add_argument("--dashboards", type=int, default=16)
+    parser.add_argument("--streams", type=int, default=4, help="producers are spread over this many stream_ids")
+    parser.add_argument("--rate", type=float, default=0, help="requests/s per producer, 0 = as fast as possible")
+    parser.add_argument("--batch-size", type=int, default=1, help="1 = POST /metrics, >1 = POST /metrics/batch")
+    parser.add_argument("--dashboard-rate", type=float, default=1.0, help="refreshes/s per dashboard client")
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the local app.py (repeatable)")
+    args = parser.parse_args()
+
+    proc = None
+    base_url = args.url
+    if base_url is None:
+        proc, base_url = start_server(args.port, dict(e.split("=", 1) for e in args.env))
+    try:
+        jobs = [("ingest", base_url, "bench-%d" % (i % args.streams), args.rate, args.batch_size,
+                 args.duration) for i in range(args.producers)]
+        jobs += [("dashboard", base_url, "bench-%d" % (i % args.streams), args.dashboard_rate,
+                  args.duration) for i in range(args.dashboards)]
+        with mp.Pool(len(jobs)) as pool:
+            results = pool.starmap(run_client, jobs)
+        report("ingest", [r for r in results if r[0] == "ingest"], args.duration)
+        report("dashboard", [r for r in results if r[0] == "dashboard"], args.duration)
+        server_summary(base_url)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
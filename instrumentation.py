@@ -0,0 +1,158 @@
+from bisect import bisect_left
+import threading
+import time
+
+
+# =======================
+# Latency / size histograms
+# =======================
+# Prometheus-style cumulative histograms kept in plain lists under one lock.
+# Exposed as text format by render() for GET /internal/stats.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+RATE_WINDOW_S = 10
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        out = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            out.append("%s_bucket{%s} %d" % (name, _labels(labels, le=_fmt(bound)), cumulative))
+        out.append("%s_bucket{%s} %d" % (name, _labels(labels, le="+Inf"), self.count))
+        out.append("%s_sum{%s} %s" % (name, _labels(labels), _fmt(self.sum)))
+        out.append("%s_count{%s} %d" % (name, _labels(labels), self.count))
+        return out
+
+
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    return ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in items)
+
+
+# =======================
+# Ingest rate
+# =======================
+# Per-second buckets over the last RATE_WINDOW_S seconds, so the gauge is
+# readable without a Prometheus server doing rate() on the counter. One slot
+# more than the window, so the current second never reuses a slot that is
+# still being counted.
+class RateWindow:
+    def __init__(self, window=RATE_WINDOW_S):
+        self.window = window
+        self._slots = [0] * (window + 1)
+        self._stamps = [0] * (window + 1)
+
+    def add(self, n, now=None):
+        second = int(now if now is not None else time.time())
+        i = second % len(self._slots)
+        if self._stamps[i] != second:
+            self._stamps[i] = second
+            self._slots[i] = 0
+        self._slots[i] += n
+
+    def rate(self, now=None):
+        second = int(now if now is not None else time.time())
+        # Only completed seconds, so the current partial one doesn't drag it down.
+        total = sum(c for c, s in zip(self._slots, self._stamps)
+                    if second - self.window <= s < second)
+        return total / self.window
+
+
+# =======================
+# Stats registry
+# =======================
+class Stats:
+    def __init__(self, prefix="met"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._route_latency = {}
+        self._route_request_bytes = {}
+        self._route_response_bytes = {}
+        self._callback_latency = {}
+        self._callback_response_bytes = {}
+        self._ingest_total = {}
+        self._ingest_rate = {}
+        self.started = time.time()
+
+    def observe_route(self, route, method, status, seconds, request_bytes, response_bytes):
+        key = (("route", route), ("method", method), ("status", status))
+        size_key = key[:2]
+        with self._lock:
+            _get(self._route_latency, key, LATENCY_BUCKETS).observe(seconds)
+            _get(self._route_request_bytes, size_key, SIZE_BUCKETS).observe(request_bytes)
+            _get(self._route_response_bytes, size_key, SIZE_BUCKETS).observe(response_bytes)
+
+    def observe_callback(self, callback, seconds, response_bytes):
+        key = (("callback", callback),)
+        with self._lock:
+            _get(self._callback_latency, key, LATENCY_BUCKETS).observe(seconds)
+            _get(self._callback_response_bytes, key, SIZE_BUCKETS).observe(response_bytes)
+
+    def count_ingest(self, endpoint, n):
+        key = (("endpoint", endpoint),)
+        with self._lock:
+            self._ingest_total[key] = self._ingest_total.get(key, 0) + n
+            window = self._ingest_rate.get(key)
+            if window is None:
+                window = self._ingest_rate[key] = RateWindow()
+            window.add(n)
+
+    def render(self):
+        p = self.prefix
+        out = []
+        with self._lock:
+            for name, help_text, series in (
+                ("http_request_duration_seconds", "Flask route latency.", self._route_latency),
+                ("http_request_size_bytes", "Request body size.", self._route_request_bytes),
+                ("http_response_size_bytes", "Response body size.", self._route_response_bytes),
+                ("dash_callback_duration_seconds", "Dash callback latency.", self._callback_latency),
+                ("dash_callback_response_size_bytes", "Dash callback payload size.",
+                 self._callback_response_bytes),
+            ):
+                out.append("# HELP %s_%s %s" % (p, name, help_text))
+                out.append("# TYPE %s_%s histogram" % (p, name))
+                for labels, hist in sorted(series.items()):
+                    out.extend(hist.lines("%s_%s" % (p, name), labels))
+
+            out.append("# HELP %s_ingest_samples_total Samples accepted by ingest endpoints." % p)
+            out.append("# TYPE %s_ingest_samples_total counter" % p)
+            for labels, total in sorted(self._ingest_total.items()):
+                out.append("%s_ingest_samples_total{%s} %d" % (p, _labels(labels), total))
+
+            out.append("# HELP %s_ingest_samples_per_second Ingest rate over the last %ds."
+                       % (p, RATE_WINDOW_S))
+            out.append("# TYPE %s_ingest_samples_per_second gauge" % p)
+            for labels, window in sorted(self._ingest_rate.items()):
+                out.append("%s_ingest_samples_per_second{%s} %s"
+                           % (p, _labels(labels), _fmt(window.rate())))
+
+        out.append("# HELP %s_uptime_seconds Seconds since the stats registry was created." % p)
+        out.append("# TYPE %s_uptime_seconds gauge" % p)
+        out.append("%s_uptime_seconds %s" % (p, _fmt(time.time() - self.started)))
+        return "\n".join(out) + "\n"
+
+
+def _get(series, key, buckets):
+    hist = series.get(key)
+    if hist is None:
+        hist = series[key] = Histogram(buckets)
+    return hist
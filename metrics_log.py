@@ -0,0 +1,252 @@
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+
+# =======================
+# Append-only metrics log
+# =======================
+# Every accepted stream update is appended as a small binary record:
+#
+#   record  | u32 payload_len | u32 crc32(payload) | payload
+#   payload | f64 ts | u8 len, stream_id | u8 n | n x (u8 len, key, f64 value)
+#
+# Records carry the new values of the keys that changed (NaN for None), so
+# replaying a record twice is harmless. Records go into numbered segment
+# files; a background thread writes whatever has queued up since its last
+# write and fsyncs once for the lot (group commit). Every `snapshot_every`
+# records it rolls to a new segment, writes a snapshot of the full state and
+# deletes the segments and snapshots that snapshot makes redundant.
+RECORD_HEAD = struct.Struct("<II")
+SEGMENT_RE = re.compile(r"^(\d{12})\.seg$")
+SNAPSHOT_RE = re.compile(r"^snapshot-(\d{12})\.json$")
+
+
+class MetricsLogError(Exception):
+    pass
+
+
+def encode_record(stream_id, changes, ts=None):
+    sid = stream_id.encode()[:255]
+    parts = [struct.pack("<dB", time.time() if ts is None else ts, len(sid)), sid]
+    fields = []
+    for key, value in changes.items():
+        if value is None:
+            value = math.nan
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        raw = key.encode()[:255]
+        fields.append(struct.pack("<B", len(raw)) + raw + struct.pack("<d", value))
+    parts.append(struct.pack("<B", len(fields)))
+    parts.extend(fields)
+    payload = b"".join(parts)
+    return RECORD_HEAD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode_value(value):
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def iter_records(buf, offset=0):
+    # Yields (end_offset, stream_id, changes) and stops at the first torn or
+    # corrupt record; the caller truncates the segment there.
+    end = len(buf)
+    while offset + RECORD_HEAD.size <= end:
+        length, crc = RECORD_HEAD.unpack_from(buf, offset)
+        start = offset + RECORD_HEAD.size
+        if start + length > end or zlib.crc32(buf[start:start + length]) != crc:
+            return
+        pos = start + 8
+        sid_len = buf[pos]
+        stream_id = bytes(buf[pos + 1:pos + 1 + sid_len]).decode()
+        pos += 1 + sid_len
+        n = buf[pos]
+        pos += 1
+        changes = {}
+        for _ in range(n):
+            key_len = buf[pos]
+            key = bytes(buf[pos + 1:pos + 1 + key_len]).decode()
+            pos += 1 + key_len
+            changes[key] = _decode_value(struct.unpack_from("<d", buf, pos)[0])
+            pos += 8
+        offset = start + length
+        yield offset, stream_id, changes
+
+
+class MetricsLog:
+    def __init__(self, directory, state_fn, segment_bytes=64 << 20, snapshot_every=100000):
+        self.directory = directory
+        self.state_fn = state_fn
+        self.segment_bytes = segment_bytes
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._committed = 0
+        self._since_snapshot = 0
+        self._closed = False
+        # First OSError from the writer thread; once set nothing more is
+        # written and waiters get MetricsLogError instead of blocking.
+        self.error = None
+        self._segment = None
+        self._file = None
+        self._thread = None
+
+    # ---- startup ----
+    def replay(self):
+        """Rebuild {stream_id: {key: value}} from the newest snapshot plus the
+        segments written after it, then open the log for appending."""
+        state = {}
+        first_segment = 0
+        for index in sorted(self._snapshots(), reverse=True):
+            try:
+                with open(self._snapshot_path(index)) as f:
+                    state = json.load(f)["streams"]
+                first_segment = index
+                break
+            except (OSError, ValueError, KeyError):
+                continue
+
+        segments = [i for i in self._segments() if i >= first_segment]
+        replayed = 0
+        for index in segments:
+            path = self._segment_path(index)
+            size = os.path.getsize(path)
+            good = 0
+            if size:
+                with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    for good, stream_id, changes in iter_records(buf):
+                        state.setdefault(stream_id, {}).update(changes)
+                        replayed += 1
+            if good != size:
+                # Torn tail from a crash mid-write.
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+
+        self._since_snapshot = replayed
+        self._open_segment(segments[-1] if segments else first_segment)
+        self._thread = threading.Thread(target=self._run, name="metrics-log", daemon=True)
+        self._thread.start()
+        return state
+
+    # ---- appends ----
+    def append(self, stream_id, changes):
+        record = encode_record(stream_id, changes)
+        with self._cond:
+            if self.error is None:
+                self._pending.append(record)
+            self._appended += 1
+            self._cond.notify_all()
+            return self._appended
+
+    def wait_committed(self, lsn=None, timeout=None):
+        with self._cond:
+            lsn = self._appended if lsn is None else lsn
+            done = self._cond.wait_for(
+                lambda: self._committed >= lsn or self._closed or self.error is not None, timeout)
+            if self._committed < lsn:
+                self.check()
+            return done
+
+    def check(self):
+        if self.error is not None:
+            raise MetricsLogError("metrics log writer failed: %s" % self.error)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._file is not None:
+            self._file.close()
+
+    # ---- writer thread ----
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                batch, self._pending = self._pending, []
+                upto = self._appended
+                closing = self._closed
+            try:
+                if batch:
+                    self._file.write(b"".join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self._since_snapshot += len(batch)
+                with self._cond:
+                    self._committed = upto
+                    self._cond.notify_all()
+                if batch and (self._since_snapshot >= self.snapshot_every
+                              or self._file.tell() >= self.segment_bytes):
+                    self._checkpoint()
+            except OSError as e:
+                # Disk full, I/O error, ...: stop here rather than leave
+                # waiters blocked on a thread that is gone.
+                with self._cond:
+                    self.error = e
+                    self._pending = []
+                    self._cond.notify_all()
+                return
+            if closing and not batch:
+                return
+
+    def _checkpoint(self):
+        # Everything in segments below `index` was applied before state_fn
+        # runs, so the snapshot covers them and they can go. Records queued
+        # meanwhile land in the new segment and are replayed on top.
+        index = self._segment + 1
+        self._open_segment(index)
+        state = self.state_fn()
+        tmp = self._snapshot_path(index) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"streams": state, "written_at": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._snapshot_path(index))
+        self._fsync_dir()
+        self._since_snapshot = 0
+        for old in self._segments():
+            if old < index:
+                os.remove(self._segment_path(old))
+        for old in self._snapshots():
+            if old < index:
+                os.remove(self._snapshot_path(old))
+
+    # ---- files ----
+    def _open_segment(self, index):
+        if self._file is not None:
+            self._file.close()
+        self._segment = index
+        self._file = open(self._segment_path(index), "ab")
+        self._fsync_dir()
+
+    def _fsync_dir(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, "%012d.seg" % index)
+
+    def _snapshot_path(self, index):
+        return os.path.join(self.directory, "snapshot-%012d.json" % index)
+
+    def _segments(self):
+        return sorted(int(m.group(1)) for m in map(SEGMENT_RE.match, os.listdir(self.directory)) if m)
+
+    def _snapshots(self):
+        return sorted(int(m.group(1)) for m in map(SNAPSHOT_RE.match, os.listdir(self.directory)) if m)
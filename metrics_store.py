@@ -0,0 +1,211 @@
+import threading
+
+
+FLEET_ID = "*"
+DEFAULT_STREAM = "default"
+
+
+# =======================
+# In-process metrics store
+# =======================
+# Holds the latest metrics for one inspection stream. Every accepted update
+# bumps `version` and wakes anyone blocked in `wait_for_change`, which is
+# what the push channel (/metrics/stream) sits on.
+class MetricsStore:
+    def __init__(self, initial):
+        self._data = dict(initial)
+        self._version = 0
+        # True while the store still holds the placeholder initial values.
+        self.fresh = True
+        self._cond = threading.Condition()
+
+    @property
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self._data), self._version
+
+    def update(self, incoming, on_change=None):
+        return self.apply(lambda current, fresh: incoming, on_change)
+
+    def apply(self, fn, on_change=None):
+        # fn(current, fresh) -> incoming is called under this store's lock, so
+        # read-modify-write updates (counter increments) don't lose writes.
+        # on_change(old, new) runs under the same lock, so per-stream deltas
+        # reach the fleet rollup in the order they were applied.
+        with self._cond:
+            incoming = fn(self._data, self.fresh)
+            old = dict(self._data) if on_change is not None else None
+            changed = False
+            for key, value in incoming.items():
+                if key in self._data and self._data[key] != value:
+                    self._data[key] = value
+                    changed = True
+            if changed:
+                self._version += 1
+                self.fresh = False
+                if on_change is not None:
+                    on_change(old, self._data)
+                self._cond.notify_all()
+            return dict(self._data), self._version
+
+    def wait_for_change(self, last_version, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != last_version, timeout)
+            return self._version
+
+
+# =======================
+# Fleet rollup
+# =======================
+def _num(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0.0
+    return float(value)
+
+
+def _contribution(data):
+    scanned = _num(data.get("scanned"))
+    fps = _num(data.get("fps"))
+    return scanned, _num(data.get("anomalies")), fps, fps * scanned
+
+
+def fleet_view(scanned, anomalies, fps_sum, fps_scanned, streams):
+    return {
+        "scanned": int(scanned),
+        "anomalies": int(anomalies),
+        "total_normal": int(scanned - anomalies),
+        "fps": round(fps_scanned / scanned, 2) if scanned else 0,
+        "fps_total": round(fps_sum, 2),
+        "percent_anomalous": round(anomalies / scanned * 100, 2) if scanned else 0,
+        "threshold": None,
+        "streams": int(streams),
+    }
+
+
+# Running totals across every stream. Streams push deltas in on each change,
+# so reading the fleet view never walks the streams.
+class FleetRollup:
+    def __init__(self):
+        self._scanned = 0.0
+        self._anomalies = 0.0
+        self._fps_sum = 0.0
+        self._fps_scanned = 0.0
+        self._streams = 0
+        self._version = 0
+        self._cond = threading.Condition()
+
+    @property
+    def version(self):
+        return self._version
+
+    def add_stream(self, data):
+        with self._cond:
+            self._streams += 1
+            self._apply(None, data)
+
+    def apply(self, old, new):
+        with self._cond:
+            self._apply(old, new)
+
+    def _apply(self, old, new):
+        d_new = _contribution(new)
+        d_old = _contribution(old) if old is not None else (0.0, 0.0, 0.0, 0.0)
+        self._scanned += d_new[0] - d_old[0]
+        self._anomalies += d_new[1] - d_old[1]
+        self._fps_sum += d_new[2] - d_old[2]
+        self._fps_scanned += d_new[3] - d_old[3]
+        self._version += 1
+        self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return fleet_view(self._scanned, self._anomalies, self._fps_sum,
+                              self._fps_scanned, self._streams), self._version
+
+    def wait_for_change(self, last_version, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != last_version, timeout)
+            return self._version
+
+
+# =======================
+# Stream registry
+# =======================
+class Stream:
+    def __init__(self, stream_id, store, history, scores):
+        self.stream_id = stream_id
+        self.store = store
+        self.history = history
+        self.scores = scores
+
+
+# One MetricsStore (and its own lock) per stream_id, so writers on different
+# cameras never contend. The registry lock is only taken to create a stream.
+class StreamRegistry:
+    def __init__(self, initial, history_factory, scores_factory):
+        self._initial = dict(initial)
+        self._history_factory = history_factory
+        self._scores_factory = scores_factory
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.fleet = FleetRollup()
+        # on_update(stream_id, old, new) runs under the stream's lock after
+        # each change, e.g. to journal it in the same order it was applied.
+        self.on_update = None
+
+    def stream_ids(self):
+        return sorted(self._streams)
+
+    def get(self, stream_id, create=True):
+        stream = self._streams.get(stream_id)
+        if stream is not None:
+            return stream
+        if stream_id == FLEET_ID:
+            if create:
+                raise ValueError("%r is reserved for the fleet view" % FLEET_ID)
+            return None
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                store = self._open_store(stream_id, create)
+                if store is None:
+                    return None
+                stream = Stream(stream_id, store, self._history_factory(), self._scores_factory())
+                self._streams[stream_id] = stream
+            return stream
+
+    def _open_store(self, stream_id, create):
+        if not create:
+            return None
+        self.fleet.add_stream(self._initial)
+        return MetricsStore(self._initial)
+
+    def all(self):
+        return list(self._streams.values())
+
+    def view(self, stream_id):
+        # Anything with snapshot()/wait_for_change(): a stream's store or
+        # the fleet rollup. None if the stream does not exist.
+        if stream_id == FLEET_ID:
+            return self.fleet
+        stream = self.get(stream_id, create=False)
+        return stream.store if stream is not None else None
+
+    def update(self, stream_id, incoming):
+        return self.apply(stream_id, lambda current, fresh: incoming)
+
+    def apply(self, stream_id, fn):
+        # fn(current, fresh) -> incoming, see MetricsStore.apply.
+        stream = self.get(stream_id)
+        hook = self.on_update
+        if hook is None:
+            on_change = self.fleet.apply
+        else:
+            def on_change(old, new):
+                self.fleet.apply(old, new)
+                hook(stream_id, old, new)
+        data, version = stream.store.apply(fn, on_change=on_change)
+        return stream, data, version
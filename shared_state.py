@@ -0,0 +1,291 @@
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from metrics_store import FleetRollup, MetricsStore, StreamRegistry, _contribution, fleet_view
+
+
+# =======================
+# Shared metrics block
+# =======================
+# Fixed-layout mmap'd file (put it on /dev/shm for plain shared memory) that
+# every worker process maps, so a POST handled by one worker is visible to
+# GETs and dashboard callbacks on all the others.
+#
+#   header  | magic 8s | u32 n_slots | u32 n_fields | u32 used | pad to 64
+#   slot[i] | u64 seq | u64 version | 48s id | n_fields x float64
+#
+# Slot 0 holds the fleet rollup; streams take slots 1..n_slots-1 in order of
+# first appearance. Writers bump `seq` to odd, write, then bump it to even;
+# readers retry until they see the same even `seq` on both sides of their
+# copy (a seqlock), so they never block writers and never see torn values.
+# Writers exclude each other with a per-slot thread lock plus a POSIX record
+# lock on the slot's byte range, which covers other processes.
+MAGIC = b"METSHM01"
+HEADER = struct.Struct("<8sIII")
+HEADER_SIZE = 64
+N_FIELDS = 8
+ID_SIZE = 48
+SLOT_HEAD = struct.Struct("<QQ%ds" % ID_SIZE)
+SLOT_VALUES = struct.Struct("<%dd" % N_FIELDS)
+SLOT_SIZE = SLOT_HEAD.size + SLOT_VALUES.size
+FLEET_SLOT = 0
+WAIT_POLL_S = 0.05
+
+
+class _RangeLock:
+    def __init__(self, thread_lock, fd, start, length):
+        self.thread_lock = thread_lock
+        self.fd = fd
+        self.start = start
+        self.length = length
+
+    def __enter__(self):
+        # POSIX record locks belong to the process, so threads in the same
+        # worker need the thread lock as well.
+        self.thread_lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.length, self.start)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, self.length, self.start)
+        self.thread_lock.release()
+
+
+class SharedMetricsBlock:
+    def __init__(self, path, n_slots=256):
+        self.path = path
+        self.n_slots = n_slots
+        self.size = HEADER_SIZE + n_slots * SLOT_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_locks = [threading.Lock() for _ in range(n_slots)]
+        self._header_lock = threading.Lock()
+        compatible = True
+        with self._locked_header():
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, self.size)
+                self.buf = mmap.mmap(self._fd, self.size)
+                HEADER.pack_into(self.buf, 0, MAGIC, n_slots, N_FIELDS, 1)
+            else:
+                # Check the header before mapping: a block made with fewer
+                # slots is shorter than self.size.
+                header = os.pread(self._fd, HEADER.size, 0)
+                compatible = (len(header) == HEADER.size and os.fstat(self._fd).st_size == self.size
+                              and HEADER.unpack(header)[:3] == (MAGIC, n_slots, N_FIELDS))
+                if compatible:
+                    self.buf = mmap.mmap(self._fd, self.size)
+        if not compatible:
+            os.close(self._fd)
+            raise RuntimeError("%s has an incompatible metrics layout" % path)
+
+    def _offset(self, slot):
+        return HEADER_SIZE + slot * SLOT_SIZE
+
+    def _locked_header(self):
+        return _RangeLock(self._header_lock, self._fd, 0, HEADER_SIZE)
+
+    def locked(self, slot):
+        return _RangeLock(self._thread_locks[slot], self._fd, self._offset(slot), SLOT_SIZE)
+
+    # ---- seqlock read/write ----
+    def read(self, slot):
+        off = self._offset(slot)
+        while True:
+            (seq1,) = struct.unpack_from("<Q", self.buf, off)
+            if seq1 & 1:
+                time.sleep(0)
+                continue
+            raw = self.buf[off:off + SLOT_SIZE]
+            (seq2,) = struct.unpack_from("<Q", self.buf, off)
+            if seq1 == seq2:
+                _, version, _ = SLOT_HEAD.unpack_from(raw, 0)
+                return list(SLOT_VALUES.unpack_from(raw, SLOT_HEAD.size)), version
+
+    def write(self, slot, values):
+        # Caller holds locked(slot).
+        off = self._offset(slot)
+        seq, version, _ = SLOT_HEAD.unpack_from(self.buf, off)
+        struct.pack_into("<Q", self.buf, off, seq + 1)
+        SLOT_VALUES.pack_into(self.buf, off + SLOT_HEAD.size, *values)
+        struct.pack_into("<Q", self.buf, off + 8, version + 1)
+        struct.pack_into("<Q", self.buf, off, seq + 2)
+        return version + 1
+
+    def version(self, slot):
+        return struct.unpack_from("<Q", self.buf, self._offset(slot) + 8)[0]
+
+    def wait_for_change(self, slot, last_version, timeout=None):
+        # No cross-process condition variable, so poll the version word.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            version = self.version(slot)
+            if version != last_version:
+                return version
+            if deadline is not None and time.monotonic() >= deadline:
+                return version
+            time.sleep(WAIT_POLL_S)
+
+    # ---- slot directory ----
+    def _slot_id(self, slot):
+        raw = self.buf[self._offset(slot) + 16:self._offset(slot) + 16 + ID_SIZE]
+        return raw.rstrip(b"\0").decode()
+
+    def ids(self):
+        used = HEADER.unpack_from(self.buf, 0)[3]
+        return [self._slot_id(slot) for slot in range(1, used)]
+
+    def find(self, stream_id):
+        used = HEADER.unpack_from(self.buf, 0)[3]
+        for slot in range(1, used):
+            if self._slot_id(slot) == stream_id:
+                return slot
+        return None
+
+    def allocate(self, stream_id, values):
+        # Returns (slot, created). The id is written last, under the header
+        # lock, so readers scanning the directory never see a half-set slot.
+        raw = stream_id.encode()
+        if len(raw) > ID_SIZE:
+            raise ValueError("stream_id longer than %d bytes" % ID_SIZE)
+        with self._locked_header():
+            slot = self.find(stream_id)
+            if slot is not None:
+                return slot, False
+            used = HEADER.unpack_from(self.buf, 0)[3]
+            if used >= self.n_slots:
+                raise ValueError("no free metrics slots (%d in use)" % used)
+            with self.locked(used):
+                self.write(used, values)
+            self.buf[self._offset(used) + 16:self._offset(used) + 16 + ID_SIZE] = raw.ljust(ID_SIZE, b"\0")
+            struct.pack_into("<I", self.buf, 16, used + 1)
+            return used, True
+
+
+def _encode(keys, data):
+    values = [math.nan] * N_FIELDS
+    for i, key in enumerate(keys):
+        value = data.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[i] = float(value)
+    return values
+
+
+def _decode(keys, values):
+    data = {}
+    for key, value in zip(keys, values):
+        if math.isnan(value):
+            data[key] = None
+        elif value.is_integer():
+            data[key] = int(value)
+        else:
+            data[key] = value
+    return data
+
+
+# =======================
+# Shared stream store / fleet rollup
+# =======================
+# Same interface as MetricsStore and FleetRollup, backed by a block slot.
+class SharedMetricsStore(MetricsStore):
+    def __init__(self, block, slot, keys):
+        self._block = block
+        self._slot = slot
+        self._keys = keys
+
+    @property
+    def version(self):
+        return self._block.version(self._slot)
+
+    def snapshot(self):
+        values, version = self._block.read(self._slot)
+        return _decode(self._keys, values), version
+
+    @property
+    def fresh(self):
+        # allocate() wrote the placeholders as version 1.
+        return self.version <= 1
+
+    def apply(self, fn, on_change=None):
+        # The slot's record lock spans processes, so increments computed by
+        # fn add up across workers instead of overwriting each other.
+        with self._block.locked(self._slot):
+            values, version = self._block.read(self._slot)
+            old = _decode(self._keys, values)
+            incoming = fn(old, version <= 1)
+            new = dict(old)
+            for key, value in incoming.items():
+                if key in new and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    new[key] = value
+            if new != old:
+                version = self._block.write(self._slot, _encode(self._keys, new))
+                if on_change is not None:
+                    on_change(old, new)
+            return new, version
+
+    def wait_for_change(self, last_version, timeout=None):
+        return self._block.wait_for_change(self._slot, last_version, timeout)
+
+
+class SharedFleetRollup(FleetRollup):
+    def __init__(self, block):
+        self._block = block
+
+    @property
+    def version(self):
+        return self._block.version(FLEET_SLOT)
+
+    def add_stream(self, data):
+        self._apply(None, data, new_stream=True)
+
+    def apply(self, old, new):
+        self._apply(old, new)
+
+    def _apply(self, old, new, new_stream=False):
+        d_new = _contribution(new)
+        d_old = _contribution(old) if old is not None else (0.0, 0.0, 0.0, 0.0)
+        with self._block.locked(FLEET_SLOT):
+            values, _ = self._block.read(FLEET_SLOT)
+            for i in range(4):
+                values[i] += d_new[i] - d_old[i]
+            if new_stream:
+                values[4] += 1
+            self._block.write(FLEET_SLOT, values)
+
+    def snapshot(self):
+        values, version = self._block.read(FLEET_SLOT)
+        return fleet_view(*values[:5]), version
+
+    def wait_for_change(self, last_version, timeout=None):
+        return self._block.wait_for_change(FLEET_SLOT, last_version, timeout)
+
+
+# =======================
+# Shared stream registry
+# =======================
+# Streams live in the block, so every worker sees every stream. Histories and
+# score sketches stay per process.
+class SharedStreamRegistry(StreamRegistry):
+    def __init__(self, initial, history_factory, scores_factory, path, n_slots=256):
+        super().__init__(initial, history_factory, scores_factory)
+        self._keys = list(initial)
+        if len(self._keys) > N_FIELDS:
+            raise ValueError("at most %d metric fields fit in a shared slot" % N_FIELDS)
+        self.block = SharedMetricsBlock(path, n_slots)
+        self.fleet = SharedFleetRollup(self.block)
+
+    def stream_ids(self):
+        return sorted(self.block.ids())
+
+    def _open_store(self, stream_id, create):
+        if create:
+            slot, created = self.block.allocate(stream_id, _encode(self._keys, self._initial))
+            if created:
+                self.fleet.add_stream(self._initial)
+        else:
+            slot = self.block.find(stream_id)
+            if slot is None:
+                return None
+        return SharedMetricsStore(self.block, slot, self._keys)
@@ -0,0 +1,191 @@
+from array import array
+import math
+import threading
+
+
+# =======================
+# Merging t-digest
+# =======================
+# Streaming quantile sketch (Dunning's merging t-digest, k1 scale). Incoming
+# scores go into a small buffer that is folded into the centroid list once
+# full, so `add` is O(1) amortized and memory is bounded by `compression`.
+# Two digests can be merged, which is how the fleet view is built.
+class TDigest:
+    def __init__(self, compression=100):
+        self.compression = compression
+        self._means = []
+        self._weights = []
+        self._buffer = []
+        self._buffer_limit = 5 * compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x, weight=1.0):
+        self._buffer.append((x, weight))
+        self.count += weight
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if len(self._buffer) >= self._buffer_limit:
+            self._compress()
+
+    def add_many(self, xs):
+        for x in xs:
+            self.add(x)
+
+    def merge(self, other):
+        other._compress()
+        for m, w in zip(other._means, other._weights):
+            self.add(m, w)
+        if other.count:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def centroids(self):
+        self._compress()
+        return list(zip(self._means, self._weights))
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k):
+        k = max(-self.compression / 4, min(self.compression / 4, k))
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        items = sorted(list(zip(self._means, self._weights)) + self._buffer)
+        self._buffer = []
+        total = sum(w for _, w in items)
+        means, weights = [], []
+        cur_m, cur_w = items[0]
+        so_far = 0.0
+        limit = total * self._q(self._k(0.0) + 1)
+        for m, w in items[1:]:
+            if so_far + cur_w + w <= limit:
+                cur_m += (m - cur_m) * w / (cur_w + w)
+                cur_w += w
+            else:
+                means.append(cur_m)
+                weights.append(cur_w)
+                so_far += cur_w
+                limit = total * self._q(self._k(so_far / total) + 1)
+                cur_m, cur_w = m, w
+        means.append(cur_m)
+        weights.append(cur_w)
+        self._means, self._weights = means, weights
+
+    def quantile(self, q):
+        self._compress()
+        if not self._means:
+            return None
+        if len(self._means) == 1:
+            return self._means[0]
+        target = q * self.count
+        cum = 0.0
+        prev_center, prev_mean = 0.0, self.min
+        for m, w in zip(self._means, self._weights):
+            center = cum + w / 2
+            if target < center:
+                span = center - prev_center
+                frac = (target - prev_center) / span if span else 0.0
+                return prev_mean + frac * (m - prev_mean)
+            prev_center, prev_mean = center, m
+            cum += w
+        span = self.count - prev_center
+        frac = (target - prev_center) / span if span else 1.0
+        return prev_mean + min(frac, 1.0) * (self.max - prev_mean)
+
+
+# =======================
+# Fixed-bin histogram
+# =======================
+class ScoreHistogram:
+    def __init__(self, lo=0.0, hi=1.0, bins=50):
+        self.lo = lo
+        self.hi = hi
+        self.bins = bins
+        self._width = (hi - lo) / bins
+        self.counts = array("Q", bytes(8 * bins))
+        self.underflow = 0
+        self.overflow = 0
+
+    def add(self, x):
+        if x < self.lo:
+            self.underflow += 1
+        elif x >= self.hi:
+            if x == self.hi:
+                self.counts[-1] += 1
+            else:
+                self.overflow += 1
+        else:
+            self.counts[min(int((x - self.lo) / self._width), self.bins - 1)] += 1
+
+    def edges(self):
+        return [self.lo + i * self._width for i in range(self.bins + 1)]
+
+    def merge(self, other):
+        if (other.lo, other.hi, other.bins) != (self.lo, self.hi, self.bins):
+            raise ValueError("histogram layouts differ")
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+
+# =======================
+# Per-stream score statistics
+# =======================
+# Scores above the current threshold count as anomalies. Once `warmup`
+# scores have been seen the threshold follows the `percentile` of the
+# sketch; before that the fallback threshold is used.
+class ScoreStats:
+    def __init__(self, percentile=99.0, compression=100, lo=0.0, hi=1.0, bins=50,
+                 warmup=100, fallback_threshold=0.5):
+        self.percentile = percentile
+        self.warmup = warmup
+        self.fallback_threshold = fallback_threshold
+        self.digest = TDigest(compression)
+        self.histogram = ScoreHistogram(lo, hi, bins)
+        self.scanned = 0
+        self.anomalies = 0
+        self.lock = threading.Lock()
+
+    def threshold(self):
+        if self.digest.count < self.warmup:
+            return self.fallback_threshold
+        return self.digest.quantile(self.percentile / 100.0)
+
+    def add_scores(self, scores):
+        # Callers hold self.lock. Each score is judged against the threshold
+        # in force when its batch arrived. NaN and +/-inf are skipped: one inf
+        # in the sketch would pin the high quantiles (and the threshold) at inf.
+        threshold = self.threshold()
+        n = 0
+        flagged = 0
+        for s in scores:
+            if not math.isfinite(s):
+                continue
+            n += 1
+            if s > threshold:
+                flagged += 1
+            self.digest.add(s)
+            self.histogram.add(s)
+        self.scanned += n
+        self.anomalies += flagged
+        return n, flagged
+
+
+def merged_scores(stats_list, **kwargs):
+    # Fleet view: fold every stream's sketch and histogram into a fresh one.
+    merged = ScoreStats(**kwargs)
+    for stats in stats_list:
+        with stats.lock:
+            merged.digest.merge(stats.digest)
+            merged.histogram.merge(stats.histogram)
+            merged.scanned += stats.scanned
+            merged.anomalies += stats.anomalies
+    return merged
@@ -1,12 +1,21 @@
-import requests
+import argparse
+import asyncio
+import os
 import random
+import threading
 import time
 
+import requests
+
+from batch_codec import (NDJSON_TYPE, PACKED_TYPE, SCORES_TYPE, encode_ndjson,
+                         encode_packed, encode_scores)
+
 
-BACKEND_URL = "https://met-rbic.onrender.com/metrics"
+BACKEND_URL = os.environ.get("BACKEND_URL", "https://met-rbic.onrender.com/metrics")
 
-while True:
-    data = {
+
+def make_sample():
+    return {
         "scanned": random.randint(1000, 3000),
         "anomalies": random.randint(10, 60),
         "fps": round(10 + random.random() * 10, 2),
@@ -16,8 +25,215 @@ while True:
         "f1":        [round(0.55 + random.random() * 0.3, 2) for _ in range(5)],
     }
 
-    response = requests.post(BACKEND_URL, json=data)
-    print("Sent:", data)
-    print("Response:", response.json())
 
-    time.sleep(3)
+def make_frame_sample(state):
+    # One per-frame result from an edge box: running counters plus live FPS.
+    state["scanned"] += 1
+    if random.random() < 0.02:
+        state["anomalies"] += 1
+    return {
+        "ts": time.time(),
+        "scanned": state["scanned"],
+        "anomalies": state["anomalies"],
+        "total_normal": state["scanned"] - state["anomalies"],
+        "fps": round(28 + random.random() * 4, 2),
+    }
+
+
+# =======================
+# Batching client
+# =======================
+# Buffers samples and ships them to /metrics/batch over one keep-alive
+# session, either when max_batch samples are queued or every flush_interval.
+class BatchingClient:
+    def __init__(self, url=BACKEND_URL, fmt="ndjson", max_batch=256, flush_interval=0.5,
+                 stream_id=None):
+        self.url = url.rstrip("/") + "/batch"
+        self.params = {"stream_id": stream_id} if stream_id else None
+        self.fmt = fmt
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.session = requests.Session()
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, sample, autoflush=True):
+        with self._lock:
+            self._buffer.append(sample)
+            full = len(self._buffer) >= self.max_batch
+        if full and autoflush:
+            self.flush()
+        return full
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return None
+        if self.fmt == "packed":
+            body, content_type = encode_packed(batch), PACKED_TYPE
+        else:
+            body, content_type = encode_ndjson(batch), NDJSON_TYPE
+        with self._send_lock:
+            try:
+                resp = self.session.post(self.url, data=body, params=self.params,
+                                         headers={"Content-Type": content_type}, timeout=5)
+                return resp.json()
+            except Exception as e:
+                print("Error sending batch:", e)
+                return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        self.session.close()
+
+
+# =======================
+# Modes
+# =======================
+def run_single(url, period, stream_id=None):
+    # Original behaviour: one JSON POST every `period` seconds.
+    session = requests.Session()
+    while True:
+        data = make_sample()
+        if stream_id:
+            data["stream_id"] = stream_id
+        response = session.post(url, json=data)
+        print("Sent:", data)
+        print("Response:", response.json())
+        time.sleep(period)
+
+
+def run_batch(client, rate, duration):
+    state = {"scanned": 0, "anomalies": 0}
+    client.start()
+    deadline = time.monotonic() + duration if duration else None
+    next_at = time.monotonic()
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            client.add(make_frame_sample(state))
+            next_at += 1.0 / rate
+            time.sleep(max(0.0, next_at - time.monotonic()))
+    finally:
+        client.close()
+    print("Sent %d samples" % state["scanned"])
+
+
+def run_scores(url, rate, duration, flush_interval, stream_id=None):
+    # Raw per-frame anomaly scores, shipped as packed float64 every
+    # flush_interval; the server derives anomalies and threshold itself.
+    session = requests.Session()
+    params = {"stream_id": stream_id} if stream_id else None
+    url = url.rstrip("/") + "/scores"
+    per_flush = max(1, int(rate * flush_interval))
+    deadline = time.monotonic() + duration if duration else None
+    sent = 0
+    while deadline is None or time.monotonic() < deadline:
+        scores = [random.betavariate(2, 8) for _ in range(per_flush)]
+        try:
+            resp = session.post(url, data=encode_scores(scores), params=params,
+                                headers={"Content-Type": SCORES_TYPE}, timeout=5)
+            print("Response:", resp.json())
+        except Exception as e:
+            print("Error sending scores:", e)
+        sent += len(scores)
+        time.sleep(flush_interval)
+    print("Sent %d scores" % sent)
+
+
+def run_training(url, run_id, period, duration):
+    # One epoch per POST to /runs/<run_id>/epochs instead of resending the
+    # whole curve every time.
+    session = requests.Session()
+    url = "%s/runs/%s/epochs" % (url.rstrip("/").rsplit("/metrics", 1)[0], run_id)
+    deadline = time.monotonic() + duration if duration else None
+    epoch = 0
+    while deadline is None or time.monotonic() < deadline:
+        epoch += 1
+        progress = 1 - 1 / (1 + epoch / 20)
+        row = {
+            "epoch": epoch,
+            "precision": round(0.6 + 0.3 * progress + random.random() * 0.02, 4),
+            "recall":    round(0.5 + 0.35 * progress + random.random() * 0.02, 4),
+            "f1":        round(0.55 + 0.32 * progress + random.random() * 0.02, 4),
+        }
+        try:
+            print("Response:", session.post(url, json=row, timeout=5).json())
+        except Exception as e:
+            print("Error sending epoch:", e)
+        time.sleep(period)
+
+
+async def run_async(client, rate, duration):
+    # Producer and flusher as coroutines; the blocking POST runs in a worker
+    # thread so frame generation keeps its cadence.
+    state = {"scanned": 0, "anomalies": 0}
+    stop = asyncio.Event()
+    pending = set()
+
+    async def produce():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration if duration else None
+        next_at = loop.time()
+        while deadline is None or loop.time() < deadline:
+            if client.add(make_frame_sample(state), autoflush=False):
+                pending.add(asyncio.create_task(asyncio.to_thread(client.flush)))
+            next_at += 1.0 / rate
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+        stop.set()
+
+    async def flush_loop():
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), client.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.to_thread(client.flush)
+
+    await asyncio.gather(produce(), flush_loop())
+    await asyncio.gather(*pending)
+    client.session.close()
+    print("Sent %d samples" % state["scanned"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send simulated inspection metrics.")
+    parser.add_argument("--url", default=BACKEND_URL)
+    parser.add_argument("--stream-id", default=None, help="line/camera id, server default if omitted")
+    parser.add_argument("--mode", choices=["single", "batch", "async", "scores", "training"], default="single")
+    parser.add_argument("--period", type=float, default=3.0, help="seconds between sends in single/training mode")
+    parser.add_argument("--run-id", default="sim-run", help="training run id in training mode")
+    parser.add_argument("--rate", type=float, default=30.0, help="samples per second in batch/async/scores mode")
+    parser.add_argument("--format", choices=["ndjson", "packed"], default="ndjson")
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run, 0 = forever")
+    args = parser.parse_args()
+
+    if args.mode == "single":
+        run_single(args.url, args.period, args.stream_id)
+    elif args.mode == "training":
+        run_training(args.url, args.run_id, args.period, args.duration)
+    elif args.mode == "scores":
+        run_scores(args.url, args.rate, args.duration, args.flush_interval, args.stream_id)
+    else:
+        client = BatchingClient(args.url, args.format, args.max_batch, args.flush_interval,
+                                args.stream_id)
+        if args.mode == "batch":
+            run_batch(client, args.rate, args.duration)
+        else:
+            asyncio.run(run_async(client, args.rate, args.duration))
@@ -0,0 +1,393 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+import app
+from batch_codec import (NDJSON_TYPE, PACKED_TYPE, SCORES_TYPE, encode_ndjson, encode_packed,
+                         encode_scores)
+from metrics_log import MetricsLog
+from training_runs import TrainingRuns
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def client():
+    return app.server.test_client()
+
+
+@pytest.fixture
+def stream_id():
+    # The app keeps module-level state, so each test writes to its own stream.
+    return "test-" + uuid.uuid4().hex[:8]
+
+
+def get_metrics(client, stream_id):
+    resp = client.get("/metrics", query_string={"stream_id": stream_id})
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+# =======================
+# Stats
+# =======================
+def test_internal_stats(client, stream_id):
+    client.post("/metrics", json={"stream_id": stream_id, "scanned": 3})
+    resp = client.get("/internal/stats")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    text = resp.get_data(as_text=True)
+    assert 'met_ingest_samples_total{endpoint="metrics"}' in text
+    assert 'route="/metrics",method="POST"' in text
+    assert "met_uptime_seconds " in text
+
+
+# =======================
+# Streams
+# =======================
+def test_metrics_post_and_get(client, stream_id):
+    resp = client.post("/metrics", json={"stream_id": stream_id, "scanned": 40, "anomalies": 2})
+    assert resp.status_code == 200
+    assert resp.get_json()["metrics"]["scanned"] == 40
+    assert get_metrics(client, stream_id)["anomalies"] == 2
+
+    streams = client.get("/metrics/streams").get_json()
+    assert stream_id in streams["streams"]
+    assert streams["fleet"]["streams"] == len(streams["streams"])
+    assert get_metrics(client, "*")["scanned"] == streams["fleet"]["scanned"]
+    assert client.get("/metrics", query_string={"stream_id": "nope-" + stream_id}).status_code == 404
+    assert client.post("/metrics", json={"stream_id": "*", "scanned": 1}).status_code == 400
+
+
+def test_stream_views_for_unknown_streams(client, stream_id):
+    assert client.get("/metrics/stream", query_string={"stream_id": stream_id}).status_code == 404
+    assert client.get("/metrics/history",
+                      query_string={"stream_id": stream_id, "key": "scanned"}).status_code == 404
+    event = first_event(client.get("/metrics/stream", query_string={"stream_id": "*"}))
+    assert event_version(event) == app.streams.fleet.version
+
+
+# =======================
+# Push streams
+# =======================
+def first_event(resp):
+    chunk = next(iter(resp.response))
+    resp.close()
+    return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+
+def event_version(event):
+    return json.loads(event.split("data: ", 1)[1])["version"]
+
+
+def test_metrics_stream_starts_with_current_version(client):
+    client.post("/metrics", json={"scanned": 3})
+    event = first_event(client.get("/metrics/stream"))
+    assert event.startswith("retry: %d\n" % app.POLL_INTERVAL_MS)
+    assert event_version(event) == app.streams.view(app.DEFAULT_STREAM).version
+
+
+def test_push_events_are_rate_limited(monkeypatch):
+    monkeypatch.setattr(app, "STREAM_MIN_INTERVAL_S", 0.2)
+    view = app.streams.view(app.DEFAULT_STREAM)
+    events = iter(app.sse_response(view).response)
+    next(events)
+    started = time.monotonic()
+
+    def bump():
+        for i in range(10):
+            app.streams.update(app.DEFAULT_STREAM, {"fps": 100 + i})
+            time.sleep(0.01)
+
+    writer = threading.Thread(target=bump)
+    writer.start()
+    event = next(events)
+    writer.join()
+    # The first change waits out the interval and goes out with the ones
+    # that landed meanwhile.
+    assert time.monotonic() - started >= 0.19
+    assert event_version(event) == view.version
+
+
+# =======================
+# History
+# =======================
+def test_metrics_history(client, stream_id):
+    for i in range(5):
+        app.streams.get(stream_id).history.record({"scanned": i}, ts=2000.0 + i)
+    resp = client.get("/metrics/history",
+                      query_string={"stream_id": stream_id, "key": "scanned", "since": 2002})
+    assert resp.status_code == 200
+    assert resp.get_json() == {"stream_id": stream_id, "key": "scanned",
+                               "t": [2002.0, 2003.0, 2004.0], "v": [2.0, 3.0, 4.0], "seq": 5}
+
+    assert client.get("/metrics/history", query_string={"stream_id": stream_id}).status_code == 400
+    assert client.get("/metrics/history",
+                      query_string={"stream_id": stream_id, "key": "nope"}).status_code == 404
+
+
+# =======================
+# Batch ingest
+# =======================
+def test_metrics_batch_ndjson_and_packed(client, stream_id):
+    samples = [{"ts": 1000.0 + i, "scanned": i, "anomalies": 0} for i in range(1, 4)]
+    resp = client.post("/metrics/batch", data=encode_ndjson(samples), content_type=NDJSON_TYPE,
+                       query_string={"stream_id": stream_id})
+    assert resp.status_code == 200
+    assert resp.get_json()["accepted"] == 3
+
+    resp = client.post("/metrics/batch", data=encode_packed([{"ts": 1004.0, "scanned": 9}]),
+                       content_type=PACKED_TYPE, query_string={"stream_id": stream_id})
+    assert resp.status_code == 200
+    assert get_metrics(client, stream_id)["scanned"] == 9
+    assert client.post("/metrics/batch", data=b"MTB1junk", content_type=PACKED_TYPE).status_code == 400
+
+
+def test_metrics_batch_rejects_bad_values_before_applying(client, stream_id):
+    client.post("/metrics", json={"stream_id": stream_id, "scanned": 7})
+    for body in (b'{"scanned": 8}\n{"ts": "x", "scanned": 4}\n', b'{"scanned": "abc"}\n'):
+        resp = client.post("/metrics/batch", data=body, content_type=NDJSON_TYPE,
+                           query_string={"stream_id": stream_id})
+        assert resp.status_code == 400
+    assert get_metrics(client, stream_id)["scanned"] == 7
+
+
+# =======================
+# Scores
+# =======================
+def test_metrics_scores(client, stream_id):
+    resp = client.post("/metrics/scores", json=[0.1] * 9 + [0.99], query_string={"stream_id": stream_id})
+    assert resp.status_code == 200
+    assert resp.get_json() == {"status": "updated", "accepted": 10, "anomalies": 1, "threshold": 0.5}
+    resp = client.post("/metrics/scores", data=encode_scores([0.2, float("nan")]),
+                       content_type=SCORES_TYPE, query_string={"stream_id": stream_id})
+    assert resp.get_json()["accepted"] == 1
+
+    data = get_metrics(client, stream_id)
+    assert (data["scanned"], data["anomalies"], data["total_normal"]) == (11, 1, 10)
+    assert data["percent_anomalous"] == 9.09
+    assert client.post("/metrics/scores", data=b"\x00" * 5, content_type=SCORES_TYPE).status_code == 400
+
+
+def test_metrics_scores_ignore_infinite_scores(client, stream_id):
+    resp = client.post("/metrics/scores", data=b"[0.1, Infinity, -Infinity, 0.2]",
+                       content_type="application/json", query_string={"stream_id": stream_id})
+    assert resp.get_json()["accepted"] == 2
+    resp = client.post("/metrics/scores", data=encode_scores([float("inf")] * 200 + [0.1] * 200),
+                       content_type=SCORES_TYPE, query_string={"stream_id": stream_id})
+    body = resp.get_data(as_text=True)
+    assert "Infinity" not in body
+    assert json.loads(body)["threshold"] == 0.1
+    assert get_metrics(client, stream_id)["scanned"] == 202
+
+
+def test_metrics_scores_add_to_stored_counters(client, stream_id):
+    client.post("/metrics/scores", json=[0.1] * 1000, query_string={"stream_id": stream_id})
+    client.post("/metrics/scores", json=[0.1] * 10, query_string={"stream_id": stream_id})
+    assert get_metrics(client, stream_id)["scanned"] == 1010
+
+    client.post("/metrics", json={"stream_id": stream_id, "scanned": 500, "anomalies": 5})
+    client.post("/metrics/scores", json=[0.1] * 10, query_string={"stream_id": stream_id})
+    data = get_metrics(client, stream_id)
+    assert (data["scanned"], data["anomalies"], data["total_normal"]) == (510, 5, 505)
+
+
+# =======================
+# Dashboard
+# =======================
+def callback_spec(client, output):
+    return next(s for s in client.get("/_dash-dependencies").get_json() if output in s["output"])
+
+
+def dash_call(client, output, values, state, changed):
+    spec = callback_spec(client, output)
+    outputs = []
+    for part in spec["output"].strip(".").split("..."):
+        component, _, prop = part.rpartition(".")
+        outputs.append({"id": component, "property": prop})
+    body = {
+        "output": spec["output"],
+        "outputs": outputs,
+        "inputs": [dict(i, value=values.get("%s.%s" % (i["id"], i["property"]))) for i in spec["inputs"]],
+        "state": [dict(s, value=state) for s in spec["state"]],
+        "changedPropIds": [changed],
+    }
+    resp = client.post("/_dash-update-component", json=body)
+    assert resp.status_code in (200, 204)
+    return resp.get_json()["response"] if resp.status_code == 200 else {}
+
+
+def dashboard_call(client, stream_id, state):
+    values = {"update-interval.n_intervals": 1, "stream-select.value": stream_id,
+              "metrics-push.data": {"mode": "poll", "version": None}}
+    return dash_call(client, "scanned-tile.children", values, state, "update-interval.n_intervals")
+
+
+def test_dashboard_redraws_per_worker_panels_in_shared_mode(client, stream_id, monkeypatch):
+    history = app.streams.get(stream_id).history
+    now = time.time()
+    history.record({"fps": 30}, ts=now - 2)
+    client.post("/metrics", json={"stream_id": stream_id, "fps": 30})
+    state = dashboard_call(client, stream_id, None)["dashboard-state"]["data"]
+
+    monkeypatch.setattr(app, "METRICS_SHM_PATH", "/dev/shm/unused")
+    history.record({"fps": 31}, ts=now - 1)
+    client.post("/metrics", json={"stream_id": stream_id, "fps": 32})
+    response = dashboard_call(client, stream_id, state)
+    assert "figure" in response["fps-chart"]
+    assert "extendData" not in response["fps-chart"]
+    assert "data" in response["score-chart"]["figure"]
+
+
+# =======================
+# Journal
+# =======================
+def test_ingest_returns_503_when_log_fails(client, stream_id, tmp_path, monkeypatch):
+    log = MetricsLog(str(tmp_path), app.current_state)
+    log.replay()
+    log.error = OSError(28, "No space left on device")
+    monkeypatch.setattr(app, "metrics_log", log)
+    monkeypatch.setattr(app.streams, "on_update", app.log_update)
+    resp = client.post("/metrics", json={"stream_id": stream_id, "scanned": 3})
+    assert resp.status_code == 503
+    assert "No space left" in resp.get_json()["error"]
+    log.close()
+
+
+RESTART_SCRIPT = """
+import json, sys
+import app
+client = app.server.test_client()
+if sys.argv[1]:
+    client.post("/metrics", json=json.loads(sys.argv[1]))
+client.post("/metrics/scores", json=[0.1] * int(sys.argv[2]), query_string={"stream_id": "cam"})
+print(json.dumps(client.get("/metrics", query_string={"stream_id": "cam"}).get_json()))
+"""
+
+
+def test_counters_survive_restart(tmp_path):
+    env = dict(os.environ, METRICS_LOG_DIR=str(tmp_path))
+    env.pop("METRICS_SHM_PATH", None)
+    runs = [('{"stream_id": "cam", "scanned": 1000, "anomalies": 4}', 0), ("", 10), ("", 5)]
+    scanned = []
+    for body, n in runs:
+        out = subprocess.run([sys.executable, "-c", RESTART_SCRIPT, body, str(n)], cwd=ROOT, env=env,
+                             capture_output=True, text=True, timeout=120, check=True).stdout
+        scanned.append(json.loads(out.splitlines()[-1])["scanned"])
+    assert scanned == [1000, 1010, 1015]
+
+
+def test_dashboard_skips_unchanged_outputs(client, stream_id):
+    client.post("/metrics", json={"stream_id": stream_id, "scanned": 3, "anomalies": 1})
+    response = dashboard_call(client, stream_id, None)
+    assert response["scanned-tile"]["children"] == 3
+    state = response["dashboard-state"]["data"]
+    assert dashboard_call(client, stream_id, state) == {}
+
+    client.post("/metrics", json={"stream_id": stream_id, "scanned": 4, "total_normal": 3})
+    response = dashboard_call(client, stream_id, state)
+    assert response["scanned-tile"]["children"] == 4
+    assert "anomalies-tile" not in response
+    # The pie is patched in place rather than resent.
+    assert "__dash_patch_update" in json.dumps(response["pie-chart"]["figure"])
+
+
+def test_dashboard_refreshes_stream_options_when_idle(client, stream_id):
+    client.post("/metrics", json={"stream_id": stream_id, "scanned": 3})
+    state = dashboard_call(client, stream_id, None)["dashboard-state"]["data"]
+
+    client.post("/metrics", json={"stream_id": "new-" + stream_id, "scanned": 1})
+    response = dashboard_call(client, stream_id, state)
+    assert set(response) == {"stream-select", "dashboard-state"}
+    values = [o["value"] for o in response["stream-select"]["options"]]
+    assert "new-" + stream_id in values
+
+
+def test_dashboard_extends_with_out_of_order_samples(client, stream_id, monkeypatch):
+    # extendData is the in-process path; shared mode always redraws.
+    monkeypatch.setattr(app, "METRICS_SHM_PATH", None)
+    history = app.streams.get(stream_id).history
+    now = time.time()
+    history.record({"fps": 30}, ts=now)
+    client.post("/metrics", json={"stream_id": stream_id, "fps": 30})
+    state = dashboard_call(client, stream_id, None)["dashboard-state"]["data"]
+
+    # Older client timestamps are clamped to the newest one on append; they
+    # must still reach the chart.
+    history.record_many([{"ts": now - 5, "fps": 31}, {"ts": now - 4, "fps": 32}])
+    client.post("/metrics", json={"stream_id": stream_id, "fps": 32})
+    response = dashboard_call(client, stream_id, state)
+    extend = response["fps-chart"]["extendData"]
+    assert extend[0]["y"] == [[31, 32, 32]]
+    assert "figure" not in response["fps-chart"]
+
+
+# =======================
+# Training runs
+# =======================
+def test_metrics_post_takes_only_columnar_epochs(client, stream_id):
+    client.post("/metrics", json={"stream_id": stream_id, "scanned": 5, "fps": 30, "epoch": 1})
+    assert stream_id not in client.get("/runs").get_json()["runs"]
+
+    client.post("/metrics", json={"stream_id": stream_id, "epochs": [1, 2], "f1": [0.5, 0.6]})
+    columns = client.get("/runs/%s" % stream_id).get_json()["columns"]
+    assert columns == {"epoch": [1.0, 2.0], "f1": [0.5, 0.6]}
+
+
+def test_runs_epochs_and_etag(client, stream_id):
+    run_id = "run-" + stream_id
+    resp = client.post("/runs/%s/epochs" % run_id, json={"epoch": 1, "f1": 0.5})
+    assert resp.get_json()["appended"] == 1
+    resp = client.post("/runs/%s/epochs" % run_id, json=[{"epoch": 1, "f1": 0.1}, {"epoch": 2, "f1": 0.6}])
+    assert resp.get_json()["appended"] == 1
+    assert client.post("/runs/%s/epochs" % run_id, json={"f1": 0.7}).status_code == 400
+    assert client.post("/runs/%s/epochs" % run_id, json={"epoch": 2, "f1": 0.7}).status_code == 400
+    assert client.post("/runs/new-%s/epochs" % run_id, json={"epoch": "a"}).status_code == 400
+    assert "new-" + run_id not in client.get("/runs").get_json()["runs"]
+
+    assert client.get("/runs").get_json()["runs"][run_id]["epochs"] == 2
+    resp = client.get("/runs/%s" % run_id, query_string={"since_epoch": 1})
+    assert resp.get_json()["columns"] == {"epoch": [2.0], "f1": [0.6]}
+    etag = resp.headers["ETag"]
+    assert client.get("/runs/%s" % run_id, headers={"If-None-Match": etag}).status_code == 304
+    client.post("/runs/%s/epochs" % run_id, json={"epoch": 3, "f1": 0.7})
+    assert client.get("/runs/%s" % run_id, headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/runs/nope-%s" % run_id).status_code == 404
+
+
+def test_runs_stream(client, stream_id):
+    client.post("/runs/run-%s/epochs" % stream_id, json={"epoch": 1, "f1": 0.5})
+    assert event_version(first_event(client.get("/runs/stream"))) == app.training_runs.version
+
+
+def test_run_etag_differs_between_processes(client, stream_id, monkeypatch):
+    run_id = "run-" + stream_id
+    client.post("/runs/%s/epochs" % run_id, json={"epoch": 1, "f1": 0.5})
+    etag = client.get("/runs/%s" % run_id).headers["ETag"]
+    assert client.get("/runs/%s" % run_id, headers={"If-None-Match": etag}).status_code == 304
+
+    # A fresh process (or another worker) can reach the same run version
+    # with different contents.
+    other = TrainingRuns()
+    other.append(run_id, [{"epoch": 1, "f1": 0.9}])
+    monkeypatch.setattr(app, "training_runs", other)
+    resp = client.get("/runs/%s" % run_id, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.get_json()["columns"]["f1"] == [0.9]
+
+
+def test_curves_default_to_the_latest_run(client, monkeypatch):
+    runs = TrainingRuns()
+    for run_id in ("run-9", "run-10"):
+        runs.append(run_id, [{"epoch": 1, "f1": 0.5}])
+    monkeypatch.setattr(app, "training_runs", runs)
+    values = {"update-interval.n_intervals": 1, "run-select.value": None, "runs-push.data": None}
+    response = dash_call(client, "curves-chart.figure", values, None, "update-interval.n_intervals")
+    assert response["curves-state"]["data"]["run"] == "run-10"
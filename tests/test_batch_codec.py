@@ -0,0 +1,102 @@
+import struct
+
+import pytest
+
+from batch_codec import (NDJSON_TYPE, PACKED_MAGIC, PACKED_TYPE, SCORES_TYPE, BatchFormatError,
+                         decode_batch, decode_scores, encode_ndjson, encode_packed, encode_scores)
+
+
+SAMPLES = [
+    {"ts": 1700000000.25, "scanned": 10, "anomalies": 1, "fps": 29.5},
+    {"ts": 1700000000.5, "scanned": 11, "fps": 30.25},
+]
+
+
+def test_ndjson_round_trip():
+    assert decode_batch(encode_ndjson(SAMPLES), NDJSON_TYPE) == SAMPLES
+
+
+def test_ndjson_skips_blank_lines():
+    body = b'\n{"scanned": 1}\n\n{"scanned": 2}\n'
+    assert decode_batch(body, "application/x-ndjson; charset=utf-8") == [{"scanned": 1}, {"scanned": 2}]
+
+
+def test_packed_round_trip_keeps_missing_fields_missing():
+    decoded = decode_batch(encode_packed(SAMPLES), PACKED_TYPE)
+    assert decoded == SAMPLES
+    assert "anomalies" not in decoded[1]
+    assert isinstance(decoded[0]["scanned"], int)
+
+
+@pytest.mark.parametrize("body", [
+    b'{"scanned": 1}\nnot json\n',
+    b'[1, 2, 3]\n',
+])
+def test_ndjson_bad_input(body):
+    with pytest.raises(BatchFormatError):
+        decode_batch(body, NDJSON_TYPE)
+
+
+def test_packed_bad_input():
+    good = encode_packed(SAMPLES)
+    with pytest.raises(BatchFormatError, match="bad magic"):
+        decode_batch(b"XXXX" + good[4:], PACKED_TYPE)
+    with pytest.raises(BatchFormatError, match="payload bytes"):
+        decode_batch(good[:-3], PACKED_TYPE)
+    with pytest.raises(BatchFormatError, match="truncated header"):
+        decode_batch(PACKED_MAGIC + b"\x05", PACKED_TYPE)
+    no_ts = PACKED_MAGIC + struct.pack("<HB", 1, 1) + b"x" + struct.pack("<I", 0)
+    with pytest.raises(BatchFormatError, match="first field must be ts"):
+        decode_batch(no_ts, PACKED_TYPE)
+
+
+def test_unsupported_content_type():
+    with pytest.raises(BatchFormatError, match="unsupported content type"):
+        decode_batch(b"", "application/xml")
+
+
+@pytest.mark.parametrize("line", [
+    b'{"ts": "x", "scanned": 4}',
+    b'{"scanned": "abc"}',
+    b'{"scanned": true}',
+    b'{"scanned": null}',
+    b'{"scanned": [1]}',
+    b'{"fps": Infinity}',
+    b'{"fps": NaN}',
+    b'{"scanned": 1' + b"0" * 400 + b'}',
+])
+def test_ndjson_rejects_non_numeric_values(line):
+    with pytest.raises(BatchFormatError, match="must be a finite number"):
+        decode_batch(b'{"scanned": 1}\n' + line + b"\n", NDJSON_TYPE)
+
+
+def test_ndjson_allows_stream_id():
+    assert decode_batch(b'{"stream_id": "cam1", "scanned": 1}', NDJSON_TYPE) == [
+        {"stream_id": "cam1", "scanned": 1}]
+
+
+def test_packed_rejects_infinite_values_and_bad_names():
+    with pytest.raises(BatchFormatError, match="record 1"):
+        decode_batch(encode_packed([{"ts": 1.0, "fps": 1.0}, {"ts": 2.0, "fps": float("inf")}]),
+                     PACKED_TYPE)
+    bad_name = PACKED_MAGIC + struct.pack("<HB", 2, 2) + b"ts" + struct.pack("<B", 2) + b"\xff\xfe"
+    with pytest.raises(BatchFormatError, match="UTF-8"):
+        decode_batch(bad_name + struct.pack("<I", 0), PACKED_TYPE)
+
+
+def test_scores_round_trip_binary_and_json():
+    scores = [0.0, 0.125, 0.5, 1.0]
+    assert list(decode_scores(encode_scores(scores), SCORES_TYPE)) == scores
+    assert list(decode_scores(b"[0.0, 0.125, 0.5, 1.0]", "application/json")) == scores
+    assert list(decode_scores(b'{"scores": [0.5]}', "application/json")) == [0.5]
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"\x00" * 7, SCORES_TYPE),
+    (b"[0.1, ", "application/json"),
+    (b'{"values": [0.1]}', "application/json"),
+    (b'["a"]', "application/json"),
+])
+def test_scores_bad_input(body, content_type):
+    with pytest.raises(BatchFormatError):
+        decode_scores(body, content_type)
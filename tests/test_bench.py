@@ -0,0 +1,59 @@
+import math
+
+import pytest
+
+pytest.importorskip("requests")
+
+import bench
+from instrumentation import Histogram, RateWindow, Stats
+
+
+def test_percentile():
+    values = sorted(range(1, 1001))
+    assert bench.percentile(values, 0.5) == 500
+    assert bench.percentile(values, 0.99) == 990
+    assert bench.percentile(values, 0.999) == 999
+    assert bench.percentile([7], 0.999) == 7
+    assert math.isnan(bench.percentile([], 0.5))
+
+
+def test_outputs_splits_multi_output_ids():
+    output = "..scanned-tile.children...pie-chart.figure...dashboard-state.data.."
+    assert bench._outputs(output) == [
+        {"id": "scanned-tile", "property": "children"},
+        {"id": "pie-chart", "property": "figure"},
+        {"id": "dashboard-state", "property": "data"},
+    ]
+
+
+def test_histogram_lines_are_cumulative():
+    hist = Histogram((0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        hist.observe(value)
+    lines = hist.lines("x", (("route", "/m"),))
+    assert lines[:3] == ['x_bucket{route="/m",le="0.1"} 1', 'x_bucket{route="/m",le="1.0"} 3',
+                         'x_bucket{route="/m",le="+Inf"} 4']
+    assert lines[-1] == 'x_count{route="/m"} 4'
+
+
+def test_rate_window_counts_completed_seconds():
+    window = RateWindow(window=10)
+    for second in range(100, 110):
+        window.add(20, now=second)
+    window.add(1000, now=110)
+    assert window.rate(now=110) == 20
+
+
+def test_server_summary_reads_stats_text(capsys, monkeypatch):
+    stats = Stats()
+    stats.observe_route("/metrics", "POST", 200, 0.004, 10, 20)
+    stats.observe_route("/metrics", "POST", 200, 0.006, 10, 20)
+
+    class Resp:
+        text = stats.render()
+
+    monkeypatch.setattr(bench.requests, "get", lambda url, timeout: Resp)
+    bench.server_summary("http://x")
+    out = capsys.readouterr().out
+    assert 'route="/metrics",method="POST",status="200"' in out
+    assert "n=2" in out and "mean=5.00ms" in out
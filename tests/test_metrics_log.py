@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import metrics_log
+from metrics_log import MetricsLog, MetricsLogError, encode_record
+
+
+def write_updates(directory, updates, **kwargs):
+    # Applies each update to `state` before journalling it, the way the
+    # stream stores do, so checkpoints snapshot what has been appended.
+    state = {}
+    log = MetricsLog(str(directory), lambda: {k: dict(v) for k, v in state.items()}, **kwargs)
+    log.replay()
+    for stream_id, changes in updates:
+        state.setdefault(stream_id, {}).update(changes)
+        log.wait_committed(log.append(stream_id, changes))
+    log.close()
+    return state
+
+
+def replay(directory):
+    log = MetricsLog(str(directory), dict)
+    try:
+        return log.replay()
+    finally:
+        log.close()
+
+
+def test_replay_restores_last_values(tmp_path):
+    updates = [("cam1", {"scanned": i, "fps": 30.5}) for i in range(1, 6)]
+    updates.append(("cam2", {"scanned": 3, "threshold": None}))
+    expected = write_updates(tmp_path, updates)
+    assert replay(tmp_path) == expected
+    assert expected["cam2"]["threshold"] is None
+
+
+def test_replay_after_checkpoint(tmp_path):
+    updates = [("cam1", {"scanned": i, "anomalies": i // 3}) for i in range(1, 11)]
+    expected = write_updates(tmp_path, updates, snapshot_every=4)
+    files = sorted(os.listdir(tmp_path))
+    snapshots = [f for f in files if f.startswith("snapshot-")]
+    segments = [f for f in files if f.endswith(".seg")]
+    # Only the newest snapshot survives, along with the segments after it.
+    assert len(snapshots) == 1
+    assert all(f >= snapshots[0][len("snapshot-"):-len(".json")] for f in segments)
+    assert replay(tmp_path) == expected
+
+
+def test_replay_truncates_torn_tail(tmp_path):
+    expected = write_updates(tmp_path, [("cam1", {"scanned": 1}), ("cam1", {"scanned": 2})])
+    segment = os.path.join(tmp_path, sorted(f for f in os.listdir(tmp_path) if f.endswith(".seg"))[-1])
+    good_size = os.path.getsize(segment)
+    torn = encode_record("cam1", {"scanned": 3})
+    with open(segment, "ab") as f:
+        f.write(torn[:len(torn) - 4])
+    assert replay(tmp_path) == expected
+    assert os.path.getsize(segment) == good_size
+
+    # The log keeps appending after the truncated tail.
+    write_updates(tmp_path, [("cam1", {"scanned": 4})])
+    assert replay(tmp_path) == {"cam1": {"scanned": 4}}
+
+
+def test_replay_stops_at_corrupt_record(tmp_path):
+    write_updates(tmp_path, [("cam1", {"scanned": 1})])
+    segment = os.path.join(tmp_path, sorted(f for f in os.listdir(tmp_path) if f.endswith(".seg"))[-1])
+    bad = bytearray(encode_record("cam1", {"scanned": 2}))
+    bad[-1] ^= 0xFF
+    with open(segment, "ab") as f:
+        f.write(bytes(bad) + encode_record("cam1", {"scanned": 3}))
+    assert replay(tmp_path) == {"cam1": {"scanned": 1}}
+
+
+def test_writer_failure_wakes_waiters(tmp_path, monkeypatch):
+    log = MetricsLog(str(tmp_path), dict)
+    log.replay()
+    log.wait_committed(log.append("cam1", {"scanned": 1}))
+
+    def fail(fd):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(metrics_log.os, "fsync", fail)
+    lsn = log.append("cam1", {"scanned": 2})
+    with pytest.raises(MetricsLogError, match="No space left"):
+        log.wait_committed(lsn, timeout=5)
+    with pytest.raises(MetricsLogError):
+        log.check()
+    monkeypatch.undo()
+    log.close()
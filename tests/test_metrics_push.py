@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NODE = shutil.which("node")
+
+# Runs assets/metrics_push.js under node with a fake EventSource and
+# dash_clientside, then prints the interval's `disabled` after each step.
+HARNESS = """
+var vm = require("vm"), fs = require("fs");
+var sources = [], timers = [], props = {};
+function EventSource(url) { this.url = url; this.readyState = 0; sources.push(this); }
+EventSource.CLOSED = 2;
+EventSource.prototype.close = function () { this.readyState = 2; };
+var window = {EventSource: EventSource};
+var context = {window: window, EventSource: EventSource, console: console,
+               setTimeout: function (fn) { timers.push(fn); },
+               dash_clientside: {set_props: function (id, p) {
+                   props[id] = Object.assign(props[id] || {}, p); }}};
+context.window.dash_clientside = context.dash_clientside;
+vm.createContext(context);
+vm.runInContext(fs.readFileSync(process.argv[1], "utf8"), context);
+var subscribe = window.dash_clientside.metrics.subscribe;
+var out = {};
+function find(prefix) {
+    return sources.filter(function (s) { return s.url.indexOf(prefix) === 0; }).pop();
+}
+function disabled() { return props["update-interval"].disabled; }
+
+out.subscribe = subscribe("cam1", {mode: "push"});
+find("/runs").onopen();
+out.runs_open = disabled();
+find("/metrics").onopen();
+out.both_open = disabled();
+
+// /metrics/stream gives up for good (404); /runs/stream reconnects.
+var metrics = find("/metrics");
+metrics.readyState = 2;
+metrics.onerror();
+out.metrics_closed = disabled();
+find("/runs").onerror();
+find("/runs").onopen();
+out.runs_reopened = disabled();
+
+timers.shift()();
+out.reopened_url = find("/metrics").url;
+out.reopened_new = find("/metrics") !== metrics;
+find("/metrics").onopen();
+out.metrics_reopened = disabled();
+
+// A retry for a source replaced by a stream switch is dropped.
+var cam2 = (subscribe("cam2", {mode: "push"}), find("/metrics"));
+cam2.readyState = 2;
+cam2.onerror();
+subscribe("cam3", {mode: "push"});
+var count = sources.length;
+timers.shift()();
+out.stale_retry_skipped = sources.length === count;
+console.log(JSON.stringify(out));
+"""
+
+
+@pytest.mark.skipif(NODE is None, reason="node not installed")
+def test_polling_stays_on_until_both_sources_are_open():
+    result = subprocess.run([NODE, "-e", HARNESS, os.path.join(ROOT, "assets", "metrics_push.js")],
+                            capture_output=True, text=True, timeout=60, check=True)
+    out = json.loads(result.stdout)
+    assert out["subscribe"] is False
+    assert out["runs_open"] is False
+    assert out["both_open"] is True
+    assert out["metrics_closed"] is False
+    # The runs source reconnecting must not switch polling off while the
+    # metrics source is down.
+    assert out["runs_reopened"] is False
+    assert out["reopened_url"] == "/metrics/stream?stream_id=cam1" and out["reopened_new"]
+    assert out["metrics_reopened"] is True
+    assert out["stale_retry_skipped"]
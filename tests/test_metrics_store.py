@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from metrics_store import FLEET_ID, MetricsStore, StreamRegistry
+from sketch import ScoreStats
+from timeseries import MetricsHistory
+
+
+INITIAL = {"scanned": 1, "anomalies": 1, "fps": 1, "threshold": 1}
+
+
+def registry():
+    return StreamRegistry(INITIAL, MetricsHistory, ScoreStats)
+
+
+def test_store_versions_only_on_change():
+    store = MetricsStore(INITIAL)
+    data, version = store.update({"scanned": 5, "unknown": 3})
+    assert (data["scanned"], version) == (5, 1)
+    assert "unknown" not in data
+    assert store.update({"scanned": 5})[1] == 1
+    assert store.wait_for_change(1, timeout=0.01) == 1
+
+
+def test_registry_creates_streams_once_and_reserves_fleet():
+    streams = registry()
+    assert streams.get("cam1") is streams.get("cam1")
+    assert streams.get("cam2", create=False) is None
+    assert streams.view("cam2") is None
+    assert streams.view(FLEET_ID) is streams.fleet
+    with pytest.raises(ValueError):
+        streams.get(FLEET_ID)
+    assert streams.stream_ids() == ["cam1"]
+
+
+def test_fleet_rollup_tracks_stream_deltas():
+    streams = registry()
+    streams.update("cam1", {"scanned": 100, "anomalies": 10, "fps": 30})
+    streams.update("cam2", {"scanned": 300, "anomalies": 5, "fps": 10})
+    streams.update("cam1", {"scanned": 200})
+    fleet, _ = streams.fleet.snapshot()
+    assert fleet["streams"] == 2
+    assert (fleet["scanned"], fleet["anomalies"], fleet["total_normal"]) == (500, 15, 485)
+    assert fleet["fps_total"] == 40
+    # Scanned-weighted mean fps: (30 * 200 + 10 * 300) / 500
+    assert fleet["fps"] == 18.0
+    assert fleet["percent_anomalous"] == 3.0
+
+
+def test_concurrent_updates_keep_the_fleet_consistent():
+    streams = registry()
+
+    def writer(stream_id):
+        for i in range(1, 501):
+            streams.update(stream_id, {"scanned": i, "anomalies": i // 10})
+
+    threads = [threading.Thread(target=writer, args=("cam%d" % n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    fleet, _ = streams.fleet.snapshot()
+    assert (fleet["scanned"], fleet["anomalies"], fleet["streams"]) == (2000, 200, 4)
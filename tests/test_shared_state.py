@@ -0,0 +1,134 @@
+import multiprocessing as mp
+import threading
+
+import pytest
+
+from metrics_store import FLEET_ID
+from shared_state import N_FIELDS, SharedMetricsBlock, SharedStreamRegistry
+from sketch import ScoreStats
+from timeseries import MetricsHistory
+
+
+INITIAL = {"scanned": 1, "anomalies": 1, "fps": 1, "threshold": 1}
+
+# Children open their own block, as gunicorn workers would: POSIX record
+# locks are per process, so sharing the parent's descriptor would hide
+# exactly the contention these tests are about.
+ctx = mp.get_context("fork")
+
+
+def open_registry(path, n_slots=8):
+    return SharedStreamRegistry(INITIAL, MetricsHistory, ScoreStats, str(path), n_slots)
+
+
+def run_processes(target, *args, n=1):
+    procs = [ctx.Process(target=target, args=args) for _ in range(n)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+
+def increment_worker(path, n_threads, n):
+    registry = open_registry(path)
+
+    def work():
+        for _ in range(n):
+            registry.apply("cam", lambda current, fresh: {"scanned": current["scanned"] + 1})
+
+    threads = [threading.Thread(target=work) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_apply_increments_add_up_across_processes_and_threads(tmp_path):
+    path = tmp_path / "metrics"
+    registry = open_registry(path)
+    registry.get("cam")
+    run_processes(increment_worker, path, 4, 300, n=4)
+    data, _ = registry.view("cam").snapshot()
+    assert data["scanned"] == 1 + 4 * 4 * 300
+    fleet, _ = registry.fleet.snapshot()
+    assert (fleet["scanned"], fleet["streams"]) == (1 + 4 * 4 * 300, 1)
+
+
+def allocate_worker(path):
+    open_registry(path).update("cam2", {"scanned": 42, "fps": 12.5})
+
+
+def test_streams_allocated_by_another_process_are_visible(tmp_path):
+    path = tmp_path / "metrics"
+    registry = open_registry(path)
+    registry.update("cam1", {"scanned": 5})
+    assert registry.get("cam2", create=False) is None
+    run_processes(allocate_worker, path)
+
+    assert registry.stream_ids() == ["cam1", "cam2"]
+    data, _ = registry.view("cam2").snapshot()
+    assert (data["scanned"], data["fps"]) == (42, 12.5)
+    assert registry.block.find("cam2") == 2
+    # A second allocate of the same id finds the existing slot.
+    assert registry.block.allocate("cam2", [0.0] * N_FIELDS) == (2, False)
+    fleet, _ = registry.fleet.snapshot()
+    assert (fleet["scanned"], fleet["streams"]) == (47, 2)
+
+
+def test_fresh_until_first_change(tmp_path):
+    registry = open_registry(tmp_path / "metrics")
+    store = registry.get("cam").store
+    assert store.fresh
+    seen = []
+    registry.apply("cam", lambda current, fresh: seen.append(fresh) or {"scanned": 9})
+    assert seen == [True]
+    assert not store.fresh
+
+
+def test_layout_mismatch_is_rejected(tmp_path):
+    path = str(tmp_path / "metrics")
+    SharedMetricsBlock(path, n_slots=8)
+    with pytest.raises(RuntimeError, match="incompatible"):
+        SharedMetricsBlock(path, n_slots=16)
+    with open(path, "r+b") as f:
+        f.write(b"NOTMETRC")
+    with pytest.raises(RuntimeError, match="incompatible"):
+        SharedMetricsBlock(path, n_slots=8)
+
+
+def test_slot_limits(tmp_path):
+    registry = open_registry(tmp_path / "metrics", n_slots=3)
+    registry.get("cam1")
+    registry.get("cam2")
+    with pytest.raises(ValueError, match="no free metrics slots"):
+        registry.get("cam3")
+    with pytest.raises(ValueError, match="longer than"):
+        registry.get("x" * 49)
+    with pytest.raises(ValueError):
+        registry.get(FLEET_ID)
+
+
+def write_worker(path, slot, rounds):
+    block = SharedMetricsBlock(path, n_slots=4)
+    for i in range(rounds):
+        with block.locked(slot):
+            block.write(slot, [float(i)] * N_FIELDS)
+
+
+def test_seqlock_readers_never_see_torn_slots(tmp_path):
+    path = str(tmp_path / "metrics")
+    block = SharedMetricsBlock(path, n_slots=4)
+    writer = ctx.Process(target=write_worker, args=(path, 1, 20000))
+    writer.start()
+    reads = 0
+    last_version = 0
+    while writer.is_alive() or reads == 0:
+        values, version = block.read(1)
+        assert len(set(values)) == 1
+        assert version >= last_version
+        last_version = version
+        reads += 1
+    writer.join()
+    assert writer.exitcode == 0
+    assert block.read(1) == ([19999.0] * N_FIELDS, 20000)
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from sketch import ScoreHistogram, ScoreStats, TDigest, merged_scores
+
+
+def exact_quantile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+@pytest.mark.parametrize("q", [0.01, 0.1, 0.5, 0.9, 0.99, 0.999])
+def test_tdigest_quantile_error(q):
+    rng = random.Random(7)
+    values = [rng.betavariate(2, 8) for _ in range(20000)]
+    digest = TDigest(100)
+    digest.add_many(values)
+    values.sort()
+    # Rank error: the estimate should sit close to the true q in the data.
+    estimate = digest.quantile(q)
+    rank = sum(1 for x in values if x <= estimate) / len(values)
+    assert abs(rank - q) < 0.01
+    assert len(digest.centroids()) < 20000 / 10
+
+
+def test_tdigest_merge_matches_single_digest():
+    rng = random.Random(11)
+    values = [rng.random() for _ in range(10000)]
+    left, right = TDigest(), TDigest()
+    left.add_many(values[:5000])
+    right.add_many(values[5000:])
+    left.merge(right)
+    assert left.count == 10000
+    assert (left.min, left.max) == (min(values), max(values))
+    values.sort()
+    for q in (0.05, 0.5, 0.95):
+        assert abs(left.quantile(q) - exact_quantile(values, q)) < 0.02
+
+
+def test_tdigest_empty_and_single():
+    digest = TDigest()
+    assert digest.quantile(0.5) is None
+    digest.add(0.3)
+    assert digest.quantile(0.99) == 0.3
+
+
+def test_histogram_bins_and_merge():
+    hist = ScoreHistogram(0.0, 1.0, 4)
+    for x in (-0.1, 0.0, 0.3, 0.99, 1.0, 1.5):
+        hist.add(x)
+    assert list(hist.counts) == [1, 1, 0, 2]
+    assert (hist.underflow, hist.overflow) == (1, 1)
+    other = ScoreHistogram(0.0, 1.0, 4)
+    other.add(0.6)
+    hist.merge(other)
+    assert list(hist.counts) == [1, 1, 1, 2]
+    with pytest.raises(ValueError):
+        hist.merge(ScoreHistogram(0.0, 1.0, 5))
+
+
+def test_score_stats_threshold_follows_percentile_after_warmup():
+    stats = ScoreStats(percentile=90.0, warmup=100, fallback_threshold=0.5)
+    assert stats.add_scores([0.9, 0.1, float("nan")]) == (2, 1)
+    assert stats.threshold() == 0.5
+    stats.add_scores([i / 1000 for i in range(1000)])
+    assert abs(stats.threshold() - 0.9) < 0.02
+    merged = merged_scores([stats, ScoreStats()])
+    assert merged.scanned == stats.scanned
+    assert merged.digest.count == stats.digest.count
+
+
+def test_score_stats_skip_non_finite_scores():
+    stats = ScoreStats(percentile=99.0, warmup=100)
+    stats.add_scores([0.1] * 300)
+    assert stats.add_scores([float("inf"), float("-inf"), float("nan")]) == (0, 0)
+    stats.add_scores([0.2] * 300 + [0.3] * 1000)
+    assert stats.threshold() == pytest.approx(0.3)
+    assert stats.digest.max == 0.3
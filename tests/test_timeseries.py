@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from timeseries import MetricsHistory, RingSeries, lttb
+
+
+def flatten(pairs):
+    t, v = [], []
+    for ts_view, val_view in pairs:
+        t.extend(ts_view.tolist())
+        v.extend(val_view.tolist())
+    return t, v
+
+
+def test_ring_wraps_and_keeps_the_newest():
+    series = RingSeries(4)
+    for i in range(10):
+        series.append(float(i), float(i * 10))
+    assert len(series) == 4
+    pairs = series.range()
+    # The live window now crosses the end of the buffer.
+    assert len(pairs) == 2
+    assert flatten(pairs) == ([6.0, 7.0, 8.0, 9.0], [60.0, 70.0, 80.0, 90.0])
+
+
+def test_range_bounds_are_inclusive_across_the_wrap():
+    series = RingSeries(4)
+    for i in range(10):
+        series.append(float(i), float(i))
+    assert flatten(series.range(7, 8))[0] == [7.0, 8.0]
+    assert flatten(series.range(since=8))[0] == [8.0, 9.0]
+    assert flatten(series.range(until=6))[0] == [6.0]
+    assert series.range(20, 30) == []
+
+
+def test_timestamps_are_kept_non_decreasing():
+    series = RingSeries(4)
+    series.append(5.0, 1.0)
+    series.append(3.0, 2.0)
+    assert flatten(series.range())[0] == [5.0, 5.0]
+
+
+def test_tail_follows_by_count_across_the_wrap():
+    series = RingSeries(4)
+    for i in range(3):
+        series.append(10.0, float(i))
+    assert series.total == 3
+    assert flatten(series.tail(1)) == ([10.0, 10.0], [1.0, 2.0])
+    for i in range(3, 7):
+        series.append(5.0, float(i))
+    # Clamped to 10.0, wrapped past the end; 4 is the oldest live sample.
+    assert flatten(series.tail(5)) == ([10.0, 10.0], [5.0, 6.0])
+    assert flatten(series.tail(0))[1] == [3.0, 4.0, 5.0, 6.0]
+    assert series.tail(7) == []
+
+
+def test_history_tail_reports_next_seq():
+    history = MetricsHistory(capacity=8)
+    history.record({"fps": 1}, ts=1.0)
+    history.record({"fps": 2}, ts=0.5)
+    assert history.tail("fps", 1) == {"key": "fps", "t": [1.0], "v": [2.0], "seq": 2}
+    assert history.tail("missing", 0) is None
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        RingSeries(0)
+
+
+def test_max_age_applies_on_read():
+    now = time.time()
+    history = MetricsHistory(capacity=8, max_age=60)
+    history.record({"scanned": 1}, ts=now - 120)
+    history.record({"scanned": 2}, ts=now - 90)
+    # Nothing newer has been appended, but both samples are past max_age.
+    assert history.query("scanned") == {"key": "scanned", "t": [], "v": [], "seq": 2}
+
+
+def test_history_query_and_record_many():
+    history = MetricsHistory(capacity=8)
+    history.record_many([{"ts": 1.0, "scanned": 1, "fps": 30},
+                         {"ts": 2.0, "scanned": 2, "junk": "x"}], keys={"scanned", "fps"})
+    assert history.keys() == ["fps", "scanned"]
+    assert history.query("scanned") == {"key": "scanned", "t": [1.0, 2.0], "v": [1.0, 2.0], "seq": 2}
+    assert history.query("missing") is None
+
+
+def test_lttb_keeps_endpoints_and_budget():
+    t = list(range(1000))
+    v = [(i % 50) * 1.0 for i in t]
+    out_t, out_v = lttb(t, v, 100)
+    assert len(out_t) == len(out_v) == 100
+    assert (out_t[0], out_t[-1]) == (0, 999)
+    assert out_t == sorted(out_t)
+    assert lttb(t[:10], v[:10], 100) == (t[:10], v[:10])
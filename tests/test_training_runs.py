@@ -0,0 +1,54 @@
+from training_runs import RunCurves, TrainingRuns, to_rows
+
+
+def test_to_rows_accepts_every_shape():
+    assert to_rows({"epoch": 3, "f1": 0.5}) == [{"epoch": 3, "f1": 0.5}]
+    assert to_rows([{"epoch": 1}, "junk", {"epoch": 2}]) == [{"epoch": 1}, {"epoch": 2}]
+    assert to_rows({"epochs": [1, 2], "f1": [0.5, 0.6], "recall": [0.4], "fps": 30}) == [
+        {"epoch": 1, "f1": 0.5, "recall": 0.4}, {"epoch": 2, "f1": 0.6}]
+    assert to_rows({"f1": 0.5}) == []
+    assert to_rows("nope") == []
+
+
+def test_run_curves_append_only_newer_epochs():
+    run = RunCurves("r")
+    assert run.append({"epoch": 1, "f1": 0.5})
+    assert not run.append({"epoch": 1, "f1": 0.9})
+    assert not run.append({"epoch": "2", "f1": 0.9})
+    assert run.append({"epoch": 2, "f1": 0.6, "recall": 0.7})
+    assert len(run) == 2 and run.version == 2
+    # A column first seen mid-run is back-filled, and gaps come back as None.
+    assert run.slice() == {"epoch": [1.0, 2.0], "f1": [0.5, 0.6], "recall": [None, 0.7]}
+    assert run.slice(since_epoch=1) == {"epoch": [2.0], "f1": [0.6], "recall": [0.7]}
+    assert run.slice(limit=1)["epoch"] == [1.0]
+
+
+def test_training_runs_resend_appends_only_the_tail():
+    runs = TrainingRuns()
+    full = {"epochs": [1, 2, 3], "f1": [0.1, 0.2, 0.3]}
+    assert runs.append("r", to_rows(full)) == (3, 3)
+    full = {"epochs": [1, 2, 3, 4], "f1": [0.1, 0.2, 0.3, 0.4]}
+    assert runs.append("r", to_rows(full)) == (1, 4)
+    version, columns = runs.get("r", since_epoch=3)
+    assert (version, columns) == (4, {"epoch": [4.0], "f1": [0.4]})
+    assert runs.snapshot() == ({"r": {"epochs": 4, "version": 4}}, 2)
+    assert runs.get("missing") is None and runs.run_version("missing") is None
+
+
+def test_rejected_rows_do_not_create_a_run():
+    runs = TrainingRuns()
+    assert runs.append("r", [{"epoch": "a"}, {"f1": 0.5}]) == (0, 0)
+    assert runs.run_ids() == [] and runs.version == 0
+    runs.append("r", [{"epoch": 1}])
+    assert runs.append("r", [{"epoch": 1}]) == (0, 1)
+    assert runs.run_ids() == ["r"]
+
+
+def test_latest_is_the_most_recently_created_run():
+    runs = TrainingRuns()
+    assert runs.latest() is None
+    for run_id in ("run-9", "run-10", "baseline"):
+        runs.append(run_id, [{"epoch": 1}])
+    runs.append("run-9", [{"epoch": 2}])
+    assert runs.latest() == "baseline"
+    assert runs.run_ids() == ["baseline", "run-10", "run-9"]
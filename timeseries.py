@@ -0,0 +1,201 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import threading
+import time
+
+
+# =======================
+# Ring buffer for one metric
+# =======================
+# Timestamps and values live in two preallocated array('d') blocks, so memory
+# is fixed at 16 bytes per slot no matter how long the app runs. Appends are
+# O(1); old samples fall off when the buffer is full or older than max_age.
+class RingSeries:
+    def __init__(self, capacity, max_age=None):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.max_age = max_age
+        self._t = array("d", bytes(8 * capacity))
+        self._v = array("d", bytes(8 * capacity))
+        self._start = 0
+        self._size = 0
+        # Samples ever appended. Sample number k (0-based) is still live while
+        # k >= total - len(self); readers that follow the tail keep a count,
+        # since clamped timestamps can repeat.
+        self.total = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, ts, value):
+        # Keep timestamps non-decreasing so range lookups can bisect.
+        if self._size and ts < self._t[self._physical(self._size - 1)]:
+            ts = self._t[self._physical(self._size - 1)]
+        if self._size == self.capacity:
+            self._start = (self._start + 1) % self.capacity
+            self._size -= 1
+        idx = self._physical(self._size)
+        self._t[idx] = ts
+        self._v[idx] = value
+        self._size += 1
+        self.total += 1
+        if self.max_age is not None:
+            self._expire(ts - self.max_age)
+
+    def _physical(self, i):
+        return (self._start + i) % self.capacity
+
+    def _expire(self, cutoff):
+        while self._size and self._t[self._start] < cutoff:
+            self._start = (self._start + 1) % self.capacity
+            self._size -= 1
+
+    def _segments(self):
+        # The live window as at most two contiguous (lo, hi) physical ranges.
+        end = self._start + self._size
+        if end <= self.capacity:
+            return [(self._start, end)]
+        return [(self._start, self.capacity), (0, end - self.capacity)]
+
+    def range(self, since=None, until=None):
+        """Return [(timestamps, values), ...] memoryview pairs for since <= t <= until.
+
+        At most two pairs come back (the window may wrap around the end of the
+        buffer); they are views onto the live arrays, not copies. Samples older
+        than max_age are dropped first, so an idle series still ages out.
+        """
+        self._expire_now()
+        out = []
+        t_view = memoryview(self._t)
+        v_view = memoryview(self._v)
+        for lo, hi in self._segments():
+            seg = t_view[lo:hi]
+            a = 0 if since is None else bisect_left(seg, since)
+            b = hi - lo if until is None else bisect_right(seg, until)
+            if a < b:
+                out.append((t_view[lo + a:lo + b], v_view[lo + a:lo + b]))
+        return out
+
+    def tail(self, seq):
+        """Like range(), for the live samples numbered seq and up (see total)."""
+        self._expire_now()
+        out = []
+        skip = max(0, seq - (self.total - self._size))
+        t_view = memoryview(self._t)
+        v_view = memoryview(self._v)
+        for lo, hi in self._segments():
+            if skip >= hi - lo:
+                skip -= hi - lo
+                continue
+            out.append((t_view[lo + skip:hi], v_view[lo + skip:hi]))
+            skip = 0
+        return out
+
+    def _expire_now(self):
+        if self.max_age is not None:
+            self._expire(time.time() - self.max_age)
+
+
+# =======================
+# Per-metric history
+# =======================
+class MetricsHistory:
+    def __init__(self, capacity=65536, max_age=None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def keys(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def record(self, values, ts=None):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._record_locked(values, ts)
+
+    def record_many(self, samples, keys=None):
+        # One lock acquisition for a whole batch; each sample carries its own
+        # "ts" or gets the arrival time.
+        now = time.time()
+        with self._lock:
+            for sample in samples:
+                ts = sample.get("ts", now)
+                if keys is not None:
+                    sample = {k: v for k, v in sample.items() if k in keys}
+                self._record_locked(sample, ts)
+
+    def _record_locked(self, values, ts):
+        for key, value in values.items():
+            if key == "ts" or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = RingSeries(self.capacity, self.max_age)
+            series.append(ts, value)
+
+    def query(self, key, since=None, until=None):
+        # Lists are built while holding the lock: the views point at live
+        # buffers that the next append may overwrite, and range() may expire
+        # old samples.
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return None
+            return _collect(key, series, series.range(since, until))
+
+    def tail(self, key, seq):
+        # Samples appended after the first `seq`; "seq" in the result is the
+        # count to pass next time.
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return None
+            return _collect(key, series, series.tail(seq))
+
+
+def _collect(key, series, pairs):
+    t, v = [], []
+    for ts_view, val_view in pairs:
+        t.extend(ts_view.tolist())
+        v.extend(val_view.tolist())
+    return {"key": key, "t": t, "v": v, "seq": series.total}
+
+
+# =======================
+# Downsampling
+# =======================
+def lttb(t, v, n_out):
+    """Largest-Triangle-Three-Buckets: pick n_out of the points in (t, v)
+    that best preserve the visual shape of the line. First and last points
+    are always kept."""
+    n = len(t)
+    if n_out >= n or n_out < 3:
+        return list(t), list(v)
+    out_t, out_v = [t[0]], [v[0]]
+    every = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        # Average of the next bucket is the third corner of the triangle.
+        nxt_lo = int((i + 1) * every) + 1
+        nxt_hi = min(int((i + 2) * every) + 1, n)
+        span = nxt_hi - nxt_lo
+        avg_t = sum(t[nxt_lo:nxt_hi]) / span
+        avg_v = sum(v[nxt_lo:nxt_hi]) / span
+
+        lo = int(i * every) + 1
+        hi = int((i + 1) * every) + 1
+        at, av = t[a], v[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((at - avg_t) * (v[j] - av) - (at - t[j]) * (avg_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        out_t.append(t[best])
+        out_v.append(v[best])
+        a = best
+    out_t.append(t[-1])
+    out_v.append(v[-1])
+    return out_t, out_v
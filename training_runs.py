@@ -0,0 +1,140 @@
+from array import array
+from bisect import bisect_right
+import math
+import os
+import threading
+
+
+# =======================
+# Training-run curves
+# =======================
+# Per-run evaluation curves (precision/recall/f1/... by epoch) stored as one
+# growable array('d') per column, so an epoch is appended in O(1) and slices
+# come straight off the arrays. Clients may send a single epoch, a list of
+# epochs, or the whole history as parallel lists; epochs at or below the last
+# stored one are skipped, so resending full arrays only appends the new tail.
+EPOCH = "epoch"
+
+
+class RunCurves:
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.columns = {EPOCH: array("d")}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.columns[EPOCH])
+
+    @property
+    def last_epoch(self):
+        epochs = self.columns[EPOCH]
+        return epochs[-1] if epochs else -math.inf
+
+    def append(self, row):
+        epoch = row.get(EPOCH)
+        if isinstance(epoch, bool) or not isinstance(epoch, (int, float)) or epoch <= self.last_epoch:
+            return False
+        n = len(self)
+        for key, value in row.items():
+            if key == EPOCH or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            column = self.columns.get(key)
+            if column is None:
+                # A metric first seen mid-run is back-filled with NaN.
+                column = self.columns[key] = array("d", [math.nan] * n)
+            column.append(value)
+        self.columns[EPOCH].append(epoch)
+        for column in self.columns.values():
+            if len(column) == n:
+                column.append(math.nan)
+        self.version += 1
+        return True
+
+    def slice(self, since_epoch=None, limit=None):
+        epochs = self.columns[EPOCH]
+        lo = 0 if since_epoch is None else bisect_right(epochs, since_epoch)
+        hi = len(epochs) if limit is None else min(len(epochs), lo + limit)
+        return {key: [None if math.isnan(x) else x for x in memoryview(col)[lo:hi].tolist()]
+                for key, col in self.columns.items()}
+
+
+def to_rows(payload):
+    # Accepts {"epoch": 3, "f1": ...}, [{...}, ...], or the columnar shape
+    # testing_sim sends: {"epochs": [...], "f1": [...], ...}.
+    if isinstance(payload, list):
+        return [row for row in payload if isinstance(row, dict)]
+    if not isinstance(payload, dict):
+        return []
+    if isinstance(payload.get("epochs"), list):
+        epochs = payload["epochs"]
+        lists = {k: v for k, v in payload.items() if k != "epochs" and isinstance(v, list)}
+        rows = []
+        for i, epoch in enumerate(epochs):
+            row = {EPOCH: epoch}
+            for key, values in lists.items():
+                if i < len(values):
+                    row[key] = values[i]
+            rows.append(row)
+        return rows
+    if EPOCH in payload:
+        return [payload]
+    return []
+
+
+class TrainingRuns:
+    def __init__(self):
+        # Run versions restart at 0 in every process, so anything cached
+        # against them (ETags) also needs this per-instance id.
+        self.instance = os.urandom(6).hex()
+        self._runs = {}
+        self._version = 0
+        self._cond = threading.Condition()
+
+    @property
+    def version(self):
+        return self._version
+
+    def append(self, run_id, rows):
+        # A run is only created once it has an epoch, so bodies whose rows
+        # are all rejected don't leave empty runs behind.
+        with self._cond:
+            run = self._runs.get(run_id) or RunCurves(run_id)
+            added = sum(1 for row in rows if run.append(row))
+            if added:
+                self._runs[run_id] = run
+                self._version += 1
+                self._cond.notify_all()
+            return added, run.version
+
+    def run_ids(self):
+        with self._cond:
+            return sorted(self._runs)
+
+    def latest(self):
+        # Most recently created run (dicts keep insertion order), not the
+        # last id alphabetically: "run-10" sorts before "run-9".
+        with self._cond:
+            return next(reversed(self._runs), None)
+
+    def get(self, run_id, since_epoch=None, limit=None):
+        # (version, columns) or None; version doubles as the ETag.
+        with self._cond:
+            run = self._runs.get(run_id)
+            if run is None:
+                return None
+            return run.version, run.slice(since_epoch, limit)
+
+    def run_version(self, run_id):
+        with self._cond:
+            run = self._runs.get(run_id)
+            return None if run is None else run.version
+
+    def snapshot(self):
+        with self._cond:
+            return {rid: {"epochs": len(run), "version": run.version}
+                    for rid, run in self._runs.items()}, self._version
+
+    def wait_for_change(self, last_version, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != last_version, timeout)
+            return self._version